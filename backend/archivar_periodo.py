@@ -0,0 +1,152 @@
+"""Archiva las inscripciones de un periodo académico cerrado.
+
+Mueve en bloque las filas de `inscripcion` cuya `fecha_inscripcion` cae dentro del
+periodo a `inscripcion_historica`, de modo que la tabla caliente (y sus índices,
+incluido `usuario_clase_unico`) solo contenga el periodo en curso. Después libera
+los cupos de los horarios afectados y marca el periodo como cerrado.
+
+Uso (desde la carpeta backend):
+    python archivar_periodo.py 2025-2 --inicio 2025-07-01 --fin 2026-01-01
+    python archivar_periodo.py 2025-2 --simular      # solo cuenta las filas
+"""
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+import models
+from database import engine, SessionLocal
+
+
+TAMANO_LOTE_POR_DEFECTO = 50000
+
+# Un solo statement mueve cada lote: DELETE ... RETURNING alimenta el INSERT
+_MOVER_LOTE = text("""
+    WITH movidas AS (
+        DELETE FROM inscripcion
+        WHERE id IN (
+            SELECT id FROM inscripcion
+            WHERE fecha_inscripcion >= :inicio AND fecha_inscripcion < :fin
+            LIMIT :lote
+        )
+        RETURNING id, horario_id, usuario_id, fecha_inscripcion
+    )
+    INSERT INTO inscripcion_historica (id, horario_id, usuario_id, fecha_inscripcion, periodo_id)
+    SELECT id, horario_id, usuario_id, fecha_inscripcion, :periodo_id FROM movidas
+""")
+
+# El cupo disponible vuelve a ser el máximo menos las inscripciones que siguen en la tabla caliente
+_LIBERAR_CUPOS = text("""
+    UPDATE horario h
+    SET cupo_disponible = h.cupo_maximo - (SELECT COUNT(*) FROM inscripcion i WHERE i.horario_id = h.id)
+    WHERE h.id IN (SELECT DISTINCT horario_id FROM inscripcion_historica WHERE periodo_id = :periodo_id)
+""")
+
+
+def _fecha(valor: str) -> datetime:
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+
+def obtener_periodo(db, nombre: str, inicio=None, fin=None, crear: bool = True) -> models.PeriodoAcademico:
+    """Busca el periodo por nombre; si no existe lo crea con las fechas dadas.
+
+    Con `crear=False` (simulación) el periodo nuevo no se guarda en la BD.
+    """
+    periodo = None
+    if inspect(db.get_bind()).has_table(models.PeriodoAcademico.__tablename__):
+        periodo = db.query(models.PeriodoAcademico).filter(models.PeriodoAcademico.nombre == nombre).first()
+    if periodo is None:
+        if inicio is None or fin is None:
+            raise SystemExit(f"El periodo '{nombre}' no existe: indique --inicio y --fin para crearlo")
+        periodo = models.PeriodoAcademico(nombre=nombre, fecha_inicio=inicio, fecha_fin=fin)
+        if crear:
+            db.add(periodo)
+            db.commit()
+    return periodo
+
+
+def preparar_esquema():
+    """Crea las tablas nuevas y los índices de `inscripcion` que falten.
+
+    Las tablas nuevas (periodo_academico, inscripcion_historica) se crean con create_all.
+    En bases de datos creadas antes de que existiera el índice por fecha, este se crea
+    CONCURRENTLY para no bloquear las inscripciones mientras se construye. Si se
+    interrumpe puede quedar un índice INVALID: bórrelo con DROP INDEX y vuelva a ejecutar.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    tabla = models.Inscripcion.__table__
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        for indice in tabla.indexes:
+            columnas = ", ".join(columna.name for columna in indice.columns)
+            unico = "UNIQUE " if indice.unique else ""
+            conexion.execute(text(f"CREATE {unico}INDEX CONCURRENTLY IF NOT EXISTS {indice.name} ON {tabla.name} ({columnas})"))
+
+
+def archivar(nombre: str, inicio=None, fin=None, lote: int = TAMANO_LOTE_POR_DEFECTO, liberar_cupos: bool = True,
+             simular: bool = False, forzar: bool = False) -> int:
+    """Archiva el periodo `nombre` y devuelve cuántas inscripciones se movieron.
+
+    Con `simular` solo cuenta las filas: no crea tablas, índices ni el periodo.
+    """
+    if not simular:
+        preparar_esquema()
+
+    db = SessionLocal()
+    try:
+        periodo = obtener_periodo(db, nombre, inicio, fin, crear=not simular)
+        if periodo.fecha_fin > datetime.now() and not forzar:
+            raise SystemExit(f"El periodo '{nombre}' termina el {periodo.fecha_fin:%Y-%m-%d}; use --forzar para archivarlo antes")
+
+        parametros = {"inicio": periodo.fecha_inicio, "fin": periodo.fecha_fin, "periodo_id": periodo.id, "lote": lote}
+        if simular:
+            return db.execute(
+                text("SELECT COUNT(*) FROM inscripcion WHERE fecha_inscripcion >= :inicio AND fecha_inscripcion < :fin"),
+                parametros,
+            ).scalar()
+
+        # Lotes con commit propio: ninguna transacción bloquea la tabla durante todo el proceso
+        total = 0
+        while True:
+            movidas = db.execute(_MOVER_LOTE, parametros).rowcount
+            db.commit()
+            total += movidas
+            print(f"  {total} inscripciones archivadas")
+            if movidas < lote:
+                break
+
+        if liberar_cupos:
+            db.execute(_LIBERAR_CUPOS, parametros)
+        periodo.cerrado = True
+        periodo.archivado_en = datetime.now()
+        db.commit()
+        return total
+    finally:
+        db.close()
+
+
+def vacuum(reindexar: bool):
+    """Recupera el espacio de las filas movidas para que la tabla y sus índices no crezcan."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        conexion.execute(text("VACUUM ANALYZE inscripcion"))
+        if reindexar:
+            conexion.execute(text("REINDEX TABLE CONCURRENTLY inscripcion"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva las inscripciones de un periodo académico cerrado")
+    parser.add_argument("periodo", help="Nombre del periodo, ej. 2025-2")
+    parser.add_argument("--inicio", type=_fecha, help="Fecha de inicio (AAAA-MM-DD, incluida) si el periodo no existe")
+    parser.add_argument("--fin", type=_fecha, help="Fecha de fin (AAAA-MM-DD, excluida) si el periodo no existe")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE_POR_DEFECTO, help="Filas movidas por transacción")
+    parser.add_argument("--sin-liberar-cupos", action="store_true", help="No recalcula el cupo disponible de los horarios")
+    parser.add_argument("--reindexar", action="store_true", help="Reconstruye los índices de inscripcion al terminar")
+    parser.add_argument("--simular", action="store_true", help="Solo cuenta las inscripciones que se moverían")
+    parser.add_argument("--forzar", action="store_true", help="Permite archivar un periodo que aún no termina")
+    args = parser.parse_args()
+
+    total = archivar(args.periodo, args.inicio, args.fin, args.lote, not args.sin_liberar_cupos, args.simular, args.forzar)
+    if args.simular:
+        print(f"Se archivarían {total} inscripciones del periodo {args.periodo}")
+    else:
+        vacuum(args.reindexar)
+        print(f"Periodo {args.periodo} archivado: {total} inscripciones movidas a inscripcion_historica")
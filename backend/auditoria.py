@@ -0,0 +1,102 @@
+"""Registro asíncrono y por lotes de eventos de auditoría.
+
+Los endpoints llaman a `registrar(...)`, que solo encola un dict (microsegundos).
+Un hilo en segundo plano vacía la cola cada `INTERVALO` segundos o al juntar
+`TAMANO_LOTE` eventos y los guarda con un único INSERT de varias filas, fuera del
+camino de la petición.
+
+Si la cola se llena (BD caída durante mucho tiempo) los eventos nuevos se descartan
+y se cuentan en /metrics: la auditoría nunca debe frenar una inscripción.
+"""
+import logging
+import os
+import queue
+import threading
+from typing import Optional
+
+import metricas
+import models
+from database import engine
+from utilidades.time import hora_colombia
+
+
+logger = logging.getLogger("uscc.auditoria")
+
+TAMANO_LOTE = int(os.getenv("AUDITORIA_TAMANO_LOTE", "500"))
+INTERVALO = float(os.getenv("AUDITORIA_INTERVALO", "1.0"))  # segundos
+MAX_PENDIENTES = int(os.getenv("AUDITORIA_MAX_PENDIENTES", "100000"))
+
+_cola = queue.Queue(maxsize=MAX_PENDIENTES)
+_detener = threading.Event()
+_hilo: Optional[threading.Thread] = None
+
+
+def registrar(tipo: models.TipoEventoAuditoria, usuario_id: Optional[int] = None, horario_id: Optional[int] = None,
+              curso_id: Optional[int] = None, **detalle):
+    """Encola un evento. La fecha se toma ahora, no cuando se guarda."""
+    evento = {
+        "tipo": tipo,
+        "fecha": hora_colombia(),
+        "usuario_id": usuario_id,
+        "horario_id": horario_id,
+        "curso_id": curso_id,
+        "detalle": detalle or None,
+    }
+    try:
+        _cola.put_nowait(evento)
+    except queue.Full:
+        metricas.AUDITORIA_DESCARTADOS.inc()
+
+
+def _tomar_lote(timeout: float) -> list:
+    lote = []
+    try:
+        lote.append(_cola.get(timeout=timeout))
+    except queue.Empty:
+        return lote
+    while len(lote) < TAMANO_LOTE:
+        try:
+            lote.append(_cola.get_nowait())
+        except queue.Empty:
+            break
+    return lote
+
+
+def _guardar(lote: list):
+    try:
+        with engine.begin() as conexion:
+            # .values(lista) genera un solo INSERT ... VALUES (...), (...), ...
+            conexion.execute(models.EventoAuditoria.__table__.insert().values(lote))
+    except Exception:
+        logger.exception("No se pudieron guardar %d eventos de auditoría", len(lote))
+        metricas.AUDITORIA_DESCARTADOS.inc(len(lote))
+
+
+def _bucle():
+    while not _detener.is_set():
+        lote = _tomar_lote(INTERVALO)
+        if lote:
+            _guardar(lote)
+    # Al apagar vaciamos lo que quede en la cola
+    while True:
+        lote = _tomar_lote(0)
+        if not lote:
+            break
+        _guardar(lote)
+
+
+def iniciar():
+    """Arranca el hilo escritor (una vez por proceso/worker)."""
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+    _detener.clear()
+    _hilo = threading.Thread(target=_bucle, name="auditoria", daemon=True)
+    _hilo.start()
+
+
+def detener(timeout: float = 10.0):
+    """Detiene el hilo escritor tras guardar los eventos pendientes."""
+    _detener.set()
+    if _hilo is not None:
+        _hilo.join(timeout)
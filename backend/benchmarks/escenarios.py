@@ -0,0 +1,139 @@
+"""Escenarios de carga que ejecuta el benchmark.
+
+Cada escenario devuelve la lista de peticiones a lanzar y la concurrencia con la
+que se lanzan. Las peticiones se generan con un `random.Random` sembrado para
+que dos ejecuciones hagan exactamente el mismo trabajo.
+"""
+import random
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+from benchmarks.datos_sinteticos import (
+    CONTRASENA_BENCHMARK, ESCALAS, HORARIO_CARRERA_ID, HORARIO_CARRERA_INSCRIBIR_ID, HORARIOS_CARRERA_LOTE,
+)
+
+
+@dataclass
+class Peticion:
+    etiqueta: str  # Nombre estable del endpoint, se usa para agrupar métricas
+    metodo: str
+    ruta: str
+    cuerpo: dict = None
+    estados_esperados: tuple = (200,)
+
+
+@dataclass
+class Escenario:
+    nombre: str
+    concurrencia: int
+    peticiones: list = field(default_factory=list)
+    timeout: float = 30.0
+    # Horarios en los que, al terminar, no puede haber más inscritos que cupos
+    horarios_cupo: tuple = ()
+
+
+def _identificacion(usuario_id: int) -> int:
+    return 1000000 + usuario_id
+
+
+def login_masivo(rnd: random.Random, escala: dict) -> Escenario:
+    """Muchos usuarios iniciando sesión a la vez, como al abrir inscripciones."""
+    peticiones = [
+        Peticion("POST /iniciar_sesion", "POST", "/iniciar_sesion", {
+            "identificacion": _identificacion(rnd.randint(1, escala["usuarios"])),
+            "contrasena": CONTRASENA_BENCHMARK,
+        })
+        for _ in range(600)
+    ]
+    return Escenario("login_masivo", concurrencia=32, peticiones=peticiones)
+
+
+def navegacion_catalogo(rnd: random.Random, escala: dict) -> Escenario:
+    """Estudiantes consultando la lista de cursos y los horarios de cada curso."""
+    peticiones = []
+    for _ in range(2000):
+        if rnd.random() < 0.3:
+            peticiones.append(Peticion("GET /cursos", "GET", "/cursos"))
+        else:
+            curso_id = rnd.randint(1, escala["cursos"])
+            identificacion = _identificacion(rnd.randint(1, escala["usuarios"]))
+            peticiones.append(Peticion(
+                "GET /cursos/{curso_id}/horario", "GET", f"/cursos/{curso_id}/horario?identificacion={identificacion}"
+            ))
+    return Escenario("navegacion_catalogo", concurrencia=32, peticiones=peticiones)
+
+
+def _usuarios_carrera(rnd: random.Random, escala: dict) -> list:
+    return rnd.sample(range(1, escala["usuarios"] + 1), min(1000, escala["usuarios"]))
+
+
+def carrera_inscripcion(rnd: random.Random, escala: dict) -> Escenario:
+    """Muchos usuarios distintos compitiendo por los pocos cupos de un mismo horario.
+
+    Los que llegan tarde reciben 400 (sin cupo), que es una respuesta esperada; lo que
+    no puede pasar es que queden más inscritos que cupos.
+    """
+    usuarios = _usuarios_carrera(rnd, escala)
+    peticiones = [
+        Peticion(
+            "POST /horario/{horario_id},{curso_id}/inscripcion", "POST",
+            f"/horario/{HORARIO_CARRERA_ID},1/inscripcion?identificacion={_identificacion(u)}",
+            estados_esperados=(200, 400),
+        )
+        for u in usuarios
+    ]
+    return Escenario("carrera_inscripcion", concurrencia=64, peticiones=peticiones, horarios_cupo=(HORARIO_CARRERA_ID,))
+
+
+def carrera_inscribir(rnd: random.Random, escala: dict) -> Escenario:
+    """La misma carrera contra `/horario/{horario_id}/inscribir` (reserva de cupo atómica)."""
+    usuarios = _usuarios_carrera(rnd, escala)
+    peticiones = [
+        Peticion(
+            "POST /horario/{horario_id}/inscribir", "POST",
+            f"/horario/{HORARIO_CARRERA_INSCRIBIR_ID}/inscribir?identificacion={_identificacion(u)}",
+            estados_esperados=(200, 400),
+        )
+        for u in usuarios
+    ]
+    return Escenario("carrera_inscribir", concurrencia=64, peticiones=peticiones, horarios_cupo=(HORARIO_CARRERA_INSCRIBIR_ID,))
+
+
+def carrera_lote(rnd: random.Random, escala: dict) -> Escenario:
+    """La carrera contra `/inscripciones/lote`: cada usuario pide los dos horarios a la vez (todo o nada)."""
+    usuarios = _usuarios_carrera(rnd, escala)
+    peticiones = [
+        Peticion(
+            "POST /inscripciones/lote", "POST", "/inscripciones/lote",
+            {"identificacion": _identificacion(u), "horario_ids": list(HORARIOS_CARRERA_LOTE)},
+            estados_esperados=(200, 400),
+        )
+        for u in usuarios
+    ]
+    return Escenario("carrera_lote", concurrencia=64, peticiones=peticiones, horarios_cupo=HORARIOS_CARRERA_LOTE)
+
+
+def exportacion_reportes(rnd: random.Random, escala: dict) -> Escenario:
+    """Coordinadores generando el reporte JSON y el Excel de un tipo de curso."""
+    tipo = quote("Catedra Santiaguina")
+    peticiones = []
+    for _ in range(2):
+        peticiones.append(Peticion("GET /reporte_cursos/{identificacion}", "GET", f"/reporte_cursos/1?tipo_curso={tipo}"))
+        peticiones.append(Peticion("GET /reporte_cursos/{identificacion}/excel", "GET", f"/reporte_cursos/1/excel?tipo_curso={tipo}"))
+    return Escenario("exportacion_reportes", concurrencia=2, peticiones=peticiones, timeout=900.0)
+
+
+ESCENARIOS = {
+    "login_masivo": login_masivo,
+    "navegacion_catalogo": navegacion_catalogo,
+    "carrera_inscripcion": carrera_inscripcion,
+    "carrera_inscribir": carrera_inscribir,
+    "carrera_lote": carrera_lote,
+    "exportacion_reportes": exportacion_reportes,
+}
+
+
+def construir(nombres: list, escala: str, semilla: int) -> list:
+    """Construye los escenarios pedidos, en el orden en que se pasan."""
+    rnd = random.Random(semilla)
+    return [ESCENARIOS[nombre](rnd, ESCALAS[escala]) for nombre in nombres]
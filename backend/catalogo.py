@@ -0,0 +1,231 @@
+"""Snapshot en memoria (por worker) del catálogo de cursos y horarios.
+
+Los datos de `/cursos` y `/cursos/{curso_id}/horario` (nombre, día, horas, profesor,
+estado) solo cambian desde los endpoints administrativos, así que se sirven desde
+memoria. Lo único que cambia con cada inscripción, `cupo_disponible`, se sigue
+leyendo de la BD en la consulta que también comprueba al usuario.
+
+Los registros usan `__slots__` y cadenas internadas para que decenas de miles de
+horarios ocupen poca memoria por worker.
+
+Frescura:
+- Las escrituras administrativas de este worker actualizan el snapshot al momento
+  (solo el curso afectado).
+- Las de otros workers llegan como eventos de `invalidacion.py` (LISTEN/NOTIFY) y
+  recargan solo el curso afectado.
+- Además se compara la versión del catálogo (`versiones.CATALOGO`) como red de
+  seguridad: cada `SEGUNDOS_VERIFICACION_CON_EVENTOS` segundos mientras el bus de
+  eventos está conectado, o cada `SEGUNDOS_VERIFICACION` si no lo está.
+
+Las recargas y la comprobación de versión se hacen siempre contra la primaria: una
+réplica atrasada haría retroceder `_version` y el snapshot quedaría viejo.
+Todo lo que modifica `_cursos` o `_lista` se hace con `_candado` tomado.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import invalidacion
+import models
+import versiones
+from database import SessionLocal
+
+
+SEGUNDOS_VERIFICACION = float(os.getenv("CATALOGO_SEGUNDOS_VERIFICACION", "5"))
+SEGUNDOS_VERIFICACION_CON_EVENTOS = float(os.getenv("CATALOGO_SEGUNDOS_VERIFICACION_CON_EVENTOS", "3600"))
+
+
+class HorarioRegistro:
+    __slots__ = ("id", "dia", "hora_inicio", "hora_fin", "profesor", "activo")
+
+    def __init__(self, id, dia, hora_inicio, hora_fin, profesor, activo):
+        self.id = id
+        self.dia = dia
+        self.hora_inicio = hora_inicio
+        self.hora_fin = hora_fin
+        self.profesor = profesor
+        self.activo = activo
+
+
+class CursoRegistro:
+    __slots__ = ("id", "nombre", "descripcion", "tipo_curso", "imagen", "activo", "horarios")
+
+    def __init__(self, id, nombre, descripcion, tipo_curso, imagen, activo, horarios=()):
+        self.id = id
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.tipo_curso = tipo_curso
+        self.imagen = imagen
+        self.activo = activo
+        self.horarios = horarios  # tupla de HorarioRegistro ordenada por id
+
+
+def _texto(valor) -> Optional[str]:
+    # Días, horas y profesores se repiten muchísimo: internarlos comparte una sola copia
+    return sys.intern(valor) if valor is not None else None
+
+
+def _horario(fila) -> HorarioRegistro:
+    id, dia, hora_inicio, hora_fin, profesor, activo = fila
+    return HorarioRegistro(
+        id,
+        _texto(dia.value if hasattr(dia, 'value') else str(dia)),
+        _texto(hora_inicio.isoformat()) if hora_inicio else None,
+        _texto(hora_fin.isoformat()) if hora_fin else None,
+        _texto(profesor),
+        bool(activo) if activo is not None else True,
+    )
+
+
+_COLUMNAS_CURSO = (
+    models.Curso.id, models.Curso.nombre, models.Curso.descripcion,
+    models.Curso.tipo_curso, models.Curso.imagen, models.Curso.activo,
+)
+_COLUMNAS_HORARIO = (
+    models.Horario.id, models.Horario.dia, models.Horario.hora_inicio,
+    models.Horario.hora_fin, models.Horario.profesor, models.Horario.activo,
+)
+
+
+@contextmanager
+def _sesion_primaria():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class Catalogo:
+    def __init__(self):
+        self._cursos = {}  # curso_id -> CursoRegistro
+        self._lista = None  # respuesta de /cursos ya construida
+        self._version = None  # versión del catálogo que refleja el snapshot
+        self._verificado_en = 0.0
+        self._vencido = True
+        self._candado = threading.Lock()
+
+    def _cargar_todo(self, db: Session):
+        version = versiones.obtener(db, versiones.CATALOGO)
+        horarios = {}
+        for fila in db.query(models.Horario.curso_id, *_COLUMNAS_HORARIO).order_by(models.Horario.id):
+            horarios.setdefault(fila[0], []).append(_horario(fila[1:]))
+        cursos = {
+            fila[0]: CursoRegistro(*fila, horarios=tuple(horarios.get(fila[0], ())))
+            for fila in db.query(*_COLUMNAS_CURSO).order_by(models.Curso.id)
+        }
+        self._cursos = cursos
+        self._lista = None
+        self._version = version
+        self._vencido = False
+
+    def _cargar_curso(self, db: Session, curso_id: int) -> Optional[CursoRegistro]:
+        fila = db.query(*_COLUMNAS_CURSO).filter(models.Curso.id == curso_id).first()
+        if fila is None:
+            self._cursos.pop(curso_id, None)
+            self._lista = None
+            return None
+        horarios = tuple(
+            _horario(f) for f in db.query(*_COLUMNAS_HORARIO).filter(models.Horario.curso_id == curso_id).order_by(models.Horario.id)
+        )
+        curso = CursoRegistro(*fila, horarios=horarios)
+        self._cursos[curso_id] = curso
+        self._lista = None
+        return curso
+
+    def asegurar(self):
+        """Recarga el snapshot si está vencido o si otro worker cambió el catálogo."""
+        ahora = time.monotonic()
+        intervalo = SEGUNDOS_VERIFICACION_CON_EVENTOS if invalidacion.conectado() else SEGUNDOS_VERIFICACION
+        if not self._vencido and ahora - self._verificado_en < intervalo:
+            return
+        with self._candado, _sesion_primaria() as db:
+            if self._vencido or versiones.obtener(db, versiones.CATALOGO) != self._version:
+                self._cargar_todo(db)
+            self._verificado_en = ahora
+
+    def listar_cursos(self) -> list:
+        self.asegurar()
+        lista = self._lista
+        if lista is None:
+            # Se construye con el candado: un _cargar_curso concurrente no puede cambiar el
+            # diccionario a mitad ni quedar tapado por una lista construida antes que él
+            with self._candado:
+                lista = self._lista
+                if lista is None:
+                    lista = [
+                        {
+                            'id': c.id,
+                            'nombre': c.nombre,
+                            'descripcion': c.descripcion,
+                            'tipo_curso': c.tipo_curso,
+                            'imagen': c.imagen,
+                            'activo': c.activo if c.activo is not None else True,
+                        }
+                        for c in self._cursos.values()
+                    ]
+                    self._lista = lista
+        return lista
+
+    def obtener_curso(self, curso_id: int) -> Optional[CursoRegistro]:
+        """Devuelve el curso del snapshot; si no está lo busca en la BD (puede ser nuevo)."""
+        self.asegurar()
+        curso = self._cursos.get(curso_id)
+        if curso is None:
+            curso = self.recargar_curso(curso_id)
+        return curso
+
+    def recargar_curso(self, curso_id: int) -> Optional[CursoRegistro]:
+        """Vuelve a leer un solo curso y sus horarios (p. ej. si sus horarios no coinciden con la BD)."""
+        with self._candado, _sesion_primaria() as db:
+            return self._cargar_curso(db, curso_id)
+
+    def registrar_cambio(self, db: Session, curso_id: int) -> int:
+        """Llamar dentro de la transacción de una escritura administrativa sobre `curso_id`.
+
+        Incrementa la versión del catálogo y publica el evento para los demás workers
+        (Postgres solo lo entrega si se hace commit). Devuelve la nueva versión.
+        """
+        version = versiones.incrementar(db, versiones.CATALOGO)
+        invalidacion.publicar(db, invalidacion.CATALOGO, curso_id=curso_id, version=version)
+        return version
+
+    def aplicar_cambio(self, db: Session, curso_id: int, version: int):
+        """Aplica al snapshot el cambio de `curso_id` que llevó el catálogo a `version`.
+
+        Si la versión avanza exactamente una posición basta con recargar ese curso; si
+        se saltó alguna (evento perdido o desordenado) se recarga todo en la próxima lectura.
+        """
+        with self._candado:
+            if self._version is None or version <= self._version:
+                return  # el snapshot aún no existe o ya incluye este cambio
+            if version == self._version + 1:
+                self._cargar_curso(db, curso_id)
+                self._version = version
+            else:
+                self._vencido = True
+
+    def marcar_vencido(self):
+        with self._candado:
+            self._vencido = True
+
+
+catalogo = Catalogo()
+
+
+def _al_cambiar_catalogo(evento: dict):
+    # Corre en el hilo de invalidación: usa su propia sesión contra la primaria
+    db = SessionLocal()
+    try:
+        catalogo.aplicar_cambio(db, evento["curso_id"], evento["version"])
+    finally:
+        db.close()
+
+
+invalidacion.suscribir(invalidacion.CATALOGO, _al_cambiar_catalogo)
+invalidacion.suscribir(invalidacion.RECONEXION, lambda evento: catalogo.marcar_vencido())
@@ -0,0 +1,190 @@
+"""Exportación masiva de inscripciones (CSV y Parquet) para equipos de datos y archivo.
+
+El CSV se genera en Postgres con `COPY (...) TO STDOUT` y se reenvía al cliente en
+bloques, sin pasar por objetos ORM: Python solo mueve bytes. El Parquet (opcional,
+requiere `pyarrow`) se escribe por lotes desde un cursor de servidor.
+"""
+import os
+import queue
+import tempfile
+import threading
+from typing import Optional
+
+import models
+from database import engine_lectura
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él solo está disponible el CSV
+    pa = None
+    pq = None
+
+
+TAMANO_BLOQUE = 256 * 1024  # bytes que se acumulan antes de enviarlos al cliente
+FILAS_POR_LOTE = int(os.getenv("EXPORTACION_FILAS_POR_LOTE", "50000"))
+
+_CONSULTA = """
+    SELECT c.id AS curso_id, c.nombre AS curso, {tipo_curso} AS tipo_curso,
+           h.id AS horario_id, {dia} AS dia, h.hora_inicio, h.hora_fin, h.profesor,
+           i.id AS inscripcion_id, i.fecha_inscripcion,
+           u.nombre_apellido, u.identificacion, u.correo
+    FROM inscripcion i
+    JOIN horario h ON h.id = i.horario_id
+    JOIN curso c ON c.id = h.curso_id
+    JOIN usuario u ON u.id = i.usuario_id
+    {filtro}
+    ORDER BY c.id, h.id, i.id
+"""
+
+
+def _valor_enum(columna: str, enum) -> str:
+    # Postgres guarda el nombre del enum (`deporte`); la API y el Excel muestran su valor
+    # (`Deporte Formativo`), así que la exportación también
+    casos = []
+    for miembro in enum:
+        valor = miembro.value.replace("'", "''")
+        casos.append(f"WHEN '{miembro.name}' THEN '{valor}'")
+    return f"CASE {columna}::text {' '.join(casos)} END"
+
+
+def _consulta(cursor, tipo_curso: Optional[models.TipoCurso]) -> str:
+    # COPY no admite parámetros, así que los incrustamos escapados con mogrify
+    filtro = ""
+    if tipo_curso:
+        filtro = cursor.mogrify("WHERE c.tipo_curso = %s", (tipo_curso.name,)).decode()
+    return _CONSULTA.format(
+        tipo_curso=_valor_enum("c.tipo_curso", models.TipoCurso),
+        dia=_valor_enum("h.dia", models.DiaSemana),
+        filtro=filtro,
+    )
+
+
+class _Cancelado(Exception):
+    pass
+
+
+class _EscritorCola:
+    """Objeto tipo archivo para `copy_expert`: agrupa las filas en bloques y los encola."""
+
+    def __init__(self, cola: queue.Queue, cancelado: threading.Event):
+        self._cola = cola
+        self._cancelado = cancelado
+        self._buffer = bytearray()
+
+    def write(self, datos):
+        self._buffer += datos
+        if len(self._buffer) >= TAMANO_BLOQUE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.encolar(bytes(self._buffer))
+            self._buffer.clear()
+
+    def encolar(self, item):
+        # Si el cliente se desconectó abortamos el COPY en lugar de bloquearnos para siempre
+        while True:
+            if self._cancelado.is_set():
+                raise _Cancelado()
+            try:
+                self._cola.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_csv(tipo_curso: Optional[models.TipoCurso] = None):
+    """Generador de bloques CSV (con encabezado) producidos por `COPY ... TO STDOUT`."""
+    cola = queue.Queue(maxsize=16)
+    cancelado = threading.Event()
+    fin = object()
+
+    def producir():
+        escritor = _EscritorCola(cola, cancelado)
+        conexion = engine_lectura.raw_connection()
+        try:
+            cursor = conexion.cursor()
+            cursor.copy_expert(f"COPY ({_consulta(cursor, tipo_curso)}) TO STDOUT WITH CSV HEADER", escritor)
+            escritor.flush()
+            conexion.rollback()
+            escritor.encolar(fin)
+        except _Cancelado:
+            pass
+        except Exception as exc:
+            if not cancelado.is_set():
+                cola.put(exc)
+        finally:
+            conexion.close()
+
+    threading.Thread(target=producir, name="exportacion-csv", daemon=True).start()
+    try:
+        while True:
+            item = cola.get()
+            if item is fin:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelado.set()
+
+
+def disponible_parquet() -> bool:
+    return pa is not None
+
+
+def _esquema():
+    return pa.schema([
+        ("curso_id", pa.int32()),
+        ("curso", pa.string()),
+        ("tipo_curso", pa.dictionary(pa.int32(), pa.string())),
+        ("horario_id", pa.int32()),
+        ("dia", pa.dictionary(pa.int32(), pa.string())),
+        ("hora_inicio", pa.time64("us")),
+        ("hora_fin", pa.time64("us")),
+        ("profesor", pa.string()),
+        ("inscripcion_id", pa.int32()),
+        ("fecha_inscripcion", pa.timestamp("us")),
+        ("nombre_apellido", pa.string()),
+        ("identificacion", pa.int64()),
+        ("correo", pa.string()),
+    ])
+
+
+def escribir_parquet(tipo_curso: Optional[models.TipoCurso] = None) -> str:
+    """Escribe la exportación en un archivo Parquet temporal y devuelve su ruta.
+
+    Las filas se leen de un cursor de servidor en lotes de FILAS_POR_LOTE y cada lote
+    se escribe como un record batch, así la memoria no depende del tamaño de la tabla.
+    El llamador es responsable de borrar el archivo.
+    """
+    esquema = _esquema()
+    descriptor, ruta = tempfile.mkstemp(prefix="inscripciones_", suffix=".parquet")
+    os.close(descriptor)
+    conexion = engine_lectura.raw_connection()
+    try:
+        # Un cursor con nombre es un cursor de servidor: Postgres envía las filas por lotes
+        cursor = conexion.cursor(name="exportacion_parquet")
+        cursor.itersize = FILAS_POR_LOTE
+        cursor.execute(_consulta(conexion.cursor(), tipo_curso))
+        with pq.ParquetWriter(ruta, esquema, compression="zstd") as escritor:
+            while True:
+                filas = cursor.fetchmany(FILAS_POR_LOTE)
+                if not filas:
+                    break
+                columnas = list(zip(*filas))
+                arrays = [
+                    pa.array(valores, type=campo.type.value_type).dictionary_encode()
+                    if pa.types.is_dictionary(campo.type) else pa.array(valores, type=campo.type)
+                    for campo, valores in zip(esquema, columnas)
+                ]
+                escritor.write_batch(pa.RecordBatch.from_arrays(arrays, schema=esquema))
+        cursor.close()
+        conexion.rollback()
+    except Exception:
+        os.remove(ruta)
+        raise
+    finally:
+        conexion.close()
+    return ruta
@@ -0,0 +1,33 @@
+# Configuración de gunicorn para producción:
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker main:app
+#
+# Para que /metrics agregue las métricas de todos los workers hay que definir
+# PROMETHEUS_MULTIPROC_DIR apuntando a un directorio escribible.
+import os
+import shutil
+
+
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# En Render la API está detrás de un proxy: request.client.host es la IP del proxy
+# para todos. limitador.py toma la IP real del final de X-Forwarded-For (la que añadió
+# el proxy, no la que manda el cliente). Los workers heredan esta variable al crearse.
+# forwarded_allow_ips se deja en su valor por defecto para que uvicorn no reescriba
+# la IP de la conexión con la entrada de X-Forwarded-For que controla el cliente.
+os.environ.setdefault("LIMITE_PROXIES_CONFIABLES", "1")
+
+
+def on_starting(server):
+    # Los ficheros de métricas de una ejecución anterior falsearían los contadores
+    directorio = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directorio:
+        shutil.rmtree(directorio, ignore_errors=True)
+        os.makedirs(directorio, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Los gauges "live" de un worker muerto deben dejar de sumar
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,159 @@
+"""Soporte para la cabecera `Idempotency-Key` en operaciones de inscripción.
+
+El resultado de cada operación se guarda en un LRU acotado por clave. Si el cliente
+reintenta con la misma clave (p. ej. tras un timeout durante la carrera de
+inscripciones) se devuelve el resultado original sin volver a tocar la BD. Si el
+reintento llega mientras la operación original sigue en curso, espera a que termine.
+
+Por defecto los resultados viven en memoria de cada worker: con gunicorn un reintento
+que llegue a otro worker no se reconoce. Definiendo IDEMPOTENCIA_REDIS_URL (o
+LIMITE_REDIS_URL, ver limitador.py) se comparten entre todos.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from utilidades.cache_lru import CacheLRU
+
+
+MAX_RESULTADOS = int(os.getenv("IDEMPOTENCIA_MAX_RESULTADOS", "50000"))
+SEGUNDOS_VIGENCIA = int(os.getenv("IDEMPOTENCIA_SEGUNDOS_VIGENCIA", str(24 * 60 * 60)))
+# Con varios workers (gunicorn) un reintento puede llegar a otro proceso: para que también
+# se repita hay que compartir los resultados en Redis (requiere el paquete `redis`)
+REDIS_URL = os.getenv("IDEMPOTENCIA_REDIS_URL", os.getenv("LIMITE_REDIS_URL"))
+# Si el worker que ejecutaba la operación muere, su reclamo caduca pasado este tiempo
+SEGUNDOS_MAX_OPERACION = int(os.getenv("IDEMPOTENCIA_SEGUNDOS_MAX_OPERACION", "60"))
+
+
+class ResultadosMemoria:
+    """Resultados y operaciones en curso de un solo proceso."""
+
+    def __init__(self, maximo: int, ttl: float):
+        self._resultados = CacheLRU(maximo, ttl=ttl)  # clave -> (huella, estado, cuerpo)
+        self._en_curso = {}  # clave -> threading.Event de la operación que se está ejecutando
+        self._candado = threading.Lock()
+
+    def reclamar(self, clave: str) -> tuple:
+        """Devuelve (guardado, None) si ya hay resultado, (None, True) si la operación es nuestra
+        o (None, False) si otra petición la está ejecutando."""
+        with self._candado:
+            # Se mira el resultado con el candado tomado: la operación original lo guarda
+            # antes de dejar de estar en curso, así que nunca se ejecuta dos veces
+            guardado = self._resultados.obtener(clave)
+            if guardado is not None:
+                return guardado, None
+            if clave in self._en_curso:
+                return None, False
+            self._en_curso[clave] = threading.Event()
+            return None, True
+
+    def esperar(self, clave: str):
+        with self._candado:
+            evento = self._en_curso.get(clave)
+        if evento is not None:
+            evento.wait()
+
+    def guardar(self, clave: str, guardado: tuple):
+        self._resultados.guardar(clave, guardado)
+
+    def liberar(self, clave: str):
+        with self._candado:
+            self._en_curso.pop(clave).set()
+
+
+class ResultadosRedis:
+    """Resultados compartidos entre workers. Reclamar es atómico gracias a un script Lua."""
+
+    SCRIPT_RECLAMAR = """
+    local guardado = redis.call('GET', KEYS[1])
+    if guardado then
+        return guardado
+    end
+    if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, ttl: int):
+        import redis  # dependencia opcional, solo necesaria con IDEMPOTENCIA_REDIS_URL
+
+        self._ttl = ttl
+        self._cliente = redis.Redis.from_url(url)
+        self._reclamar = self._cliente.register_script(self.SCRIPT_RECLAMAR)
+
+    @staticmethod
+    def _claves(clave: str) -> list:
+        return [f"uscc:idempotencia:resultado:{clave}", f"uscc:idempotencia:en_curso:{clave}"]
+
+    def reclamar(self, clave: str) -> tuple:
+        respuesta = self._reclamar(keys=self._claves(clave), args=[SEGUNDOS_MAX_OPERACION])
+        if isinstance(respuesta, bytes):
+            huella, estado, cuerpo = json.loads(respuesta)
+            return (tuple(huella), estado, cuerpo), None
+        return None, respuesta == 1
+
+    def esperar(self, clave: str):
+        # La operación corre en otro proceso: sondeamos hasta que suelte el reclamo
+        while self._cliente.exists(self._claves(clave)[1]):
+            time.sleep(0.05)
+
+    def guardar(self, clave: str, guardado: tuple):
+        self._cliente.set(self._claves(clave)[0], json.dumps(guardado), ex=self._ttl)
+
+    def liberar(self, clave: str):
+        self._cliente.delete(self._claves(clave)[1])
+
+
+_almacen = (
+    ResultadosRedis(REDIS_URL, SEGUNDOS_VIGENCIA) if REDIS_URL
+    else ResultadosMemoria(MAX_RESULTADOS, SEGUNDOS_VIGENCIA)
+)
+
+
+def ejecutar(clave: Optional[str], huella: tuple, operacion: Callable[[], dict]) -> tuple:
+    """Ejecuta `operacion` una sola vez por `clave` y devuelve (estado, cuerpo, repetido).
+
+    - `huella` identifica la operación (ruta y parámetros); reutilizar una clave con otra
+      huella es un error del cliente (422).
+    - Se guardan los resultados exitosos y los errores 4xx; los errores 5xx no, para que
+      el reintento vuelva a intentarlo.
+    - Sin clave la operación se ejecuta normalmente.
+    """
+    if not clave:
+        estado, cuerpo = _ejecutar(operacion)
+        return estado, cuerpo, False
+
+    while True:
+        guardado, reclamada = _almacen.reclamar(clave)
+        if guardado is not None:
+            return _repetir(guardado, huella)
+        if reclamada:
+            break
+        _almacen.esperar(clave)
+
+    try:
+        estado, cuerpo = _ejecutar(operacion)
+        if estado < 500:
+            _almacen.guardar(clave, (huella, estado, cuerpo))
+        return estado, cuerpo, False
+    finally:
+        _almacen.liberar(clave)
+
+
+def _ejecutar(operacion: Callable[[], dict]) -> tuple:
+    try:
+        return 200, operacion()
+    except HTTPException as exc:
+        return exc.status_code, {"detail": exc.detail}
+
+
+def _repetir(guardado: tuple, huella: tuple) -> tuple:
+    huella_original, estado, cuerpo = guardado
+    if huella_original != huella:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otra operación")
+    return estado, cuerpo, True
@@ -0,0 +1,121 @@
+"""Bus de invalidación de cachés entre workers usando LISTEN/NOTIFY de Postgres.
+
+Con gunicorn cada worker tiene sus propias cachés en memoria (p. ej. el snapshot de
+`catalogo.py`). Cuando un worker hace una escritura administrativa publica un evento
+con `publicar(db, ...)` dentro de su transacción: Postgres solo lo entrega si hay
+commit. Cada worker mantiene un hilo escuchando el canal y llama a los suscriptores
+del tipo de evento, que desalojan o recargan sus entradas.
+
+No hace falta un broker externo. Si la conexión de escucha se pierde, al reconectar
+se notifica a los suscriptores de RECONEXION para que descarten todo (pudieron
+perderse eventos mientras tanto).
+"""
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+from typing import Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+
+logger = logging.getLogger("uscc.invalidacion")
+
+CANAL = "uscc_invalidacion"
+ACTIVA = os.getenv("INVALIDACION_ACTIVA", "true").lower() in ("1", "true", "si")
+
+# Tipos de evento
+CATALOGO = "catalogo"
+RECONEXION = "reconexion"
+
+_suscriptores = {}  # tipo -> lista de funciones(evento: dict)
+_detener = threading.Event()
+_conectado = threading.Event()
+# Identifica a este proceso como emisor. Un PID no sirve: workers de contenedores
+# iguales suelen tener los mismos PID y se descartarían los eventos de otra instancia
+_EMISOR = uuid.uuid4().hex
+_hilo: Optional[threading.Thread] = None
+
+
+def publicar(db: Session, tipo: str, **datos):
+    """Publica un evento en la transacción de `db` (se entrega al hacer commit)."""
+    evento = {"tipo": tipo, "emisor": _EMISOR, **datos}
+    db.execute(text("SELECT pg_notify(:canal, :evento)"), {"canal": CANAL, "evento": json.dumps(evento)})
+
+
+def suscribir(tipo: str, funcion: Callable[[dict], None]):
+    _suscriptores.setdefault(tipo, []).append(funcion)
+
+
+def conectado() -> bool:
+    """True mientras el hilo está escuchando: las cachés pueden confiar en los eventos."""
+    return _conectado.is_set()
+
+
+def _despachar(evento: dict):
+    for funcion in _suscriptores.get(evento.get("tipo"), ()):
+        try:
+            funcion(evento)
+        except Exception:
+            logger.exception("Error procesando evento de invalidación %s", evento)
+
+
+def _conectar():
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+    # Conexión propia fuera del pool: queda ocupada escuchando mientras viva el worker
+    url = engine.url.set(drivername="postgresql")
+    conexion = psycopg2.connect(url.render_as_string(hide_password=False))
+    conexion.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    conexion.cursor().execute(f"LISTEN {CANAL}")
+    return conexion
+
+
+def _bucle():
+    espera = 1
+    while not _detener.is_set():
+        conexion = None
+        try:
+            conexion = _conectar()
+            espera = 1
+            _conectado.set()
+            # Mientras no escuchábamos pudo cambiar cualquier cosa
+            _despachar({"tipo": RECONEXION})
+            while not _detener.is_set():
+                if select.select([conexion], [], [], 5) == ([], [], []):
+                    continue
+                conexion.poll()
+                while conexion.notifies:
+                    notificacion = conexion.notifies.pop(0)
+                    evento = json.loads(notificacion.payload)
+                    # Nuestro propio worker ya aplicó el cambio al hacer la escritura
+                    if evento.get("emisor") != _EMISOR:
+                        _despachar(evento)
+        except Exception:
+            logger.exception("Se perdió la conexión de invalidación; reintentando en %d s", espera)
+            _detener.wait(espera)
+            espera = min(espera * 2, 60)
+        finally:
+            _conectado.clear()
+            if conexion is not None:
+                conexion.close()
+
+
+def iniciar():
+    """Arranca el hilo que escucha el canal (una vez por worker)."""
+    global _hilo
+    if not ACTIVA or (_hilo is not None and _hilo.is_alive()):
+        return
+    _detener.clear()
+    _hilo = threading.Thread(target=_bucle, name="invalidacion", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    _detener.set()
@@ -0,0 +1,194 @@
+"""Limitación de intentos (token bucket) para login y registro.
+
+`/iniciar_sesion` ejecuta PBKDF2 incluso para identificaciones inexistentes, así
+que sin límite cualquiera puede convertir la CPU de la API en una granja de
+hashing. Los límites se comprueban como dependencias de FastAPI, antes de
+cualquier consulta a la BD o cálculo de hash.
+
+Los límites por IP de login solo cuentan los intentos fallidos (`registrar_fallo`):
+detrás del NAT del campus o de una sala de cómputo muchos estudiantes comparten IP y
+sus inicios de sesión correctos no deben agotar el bucket al abrir inscripciones.
+
+Los buckets viven en memoria (acotados con un LRU). Con varios workers se puede
+compartir el estado definiendo LIMITE_REDIS_URL (requiere el paquete `redis`).
+"""
+import os
+import threading
+import time
+
+from fastapi import HTTPException, Request
+
+import metricas
+from utilidades.cache_lru import CacheLRU
+
+
+MAX_BUCKETS = int(os.getenv("LIMITE_MAX_BUCKETS", "100000"))
+REDIS_URL = os.getenv("LIMITE_REDIS_URL")
+# Proxies propios delante de la API. Detrás de Render (1) la conexión llega desde el
+# proxy y la IP real es la que él añade al final de X-Forwarded-For. gunicorn.conf.py
+# lo fija en 1 para producción; con 0 (uvicorn en local) se usa la IP de la conexión.
+PROXIES_CONFIABLES = int(os.getenv("LIMITE_PROXIES_CONFIABLES", "0"))
+
+
+class BucketsMemoria:
+    """Buckets de un solo proceso guardados en un LRU acotado."""
+
+    def __init__(self, maximo: int):
+        self._buckets = CacheLRU(maximo)
+        self._candado = threading.Lock()
+
+    def consumir(self, buckets: list) -> list:
+        """Recibe [(clave, capacidad, por_segundo, costo), ...] y devuelve los segundos a esperar de cada uno.
+
+        Solo se descuenta `costo` de cada bucket si todos lo permiten (todas las esperas son 0);
+        con costo 0 el bucket solo se comprueba.
+        """
+        ahora = time.monotonic()
+        with self._candado:
+            estados = []
+            esperas = []
+            for clave, capacidad, por_segundo, _ in buckets:
+                bucket = self._buckets.obtener(clave)
+                if bucket is None:
+                    bucket = [capacidad, ahora]  # [tokens, último acceso]
+                    self._buckets.guardar(clave, bucket)
+                bucket[0] = min(capacidad, bucket[0] + (ahora - bucket[1]) * por_segundo)
+                bucket[1] = ahora
+                estados.append(bucket)
+                esperas.append(0.0 if bucket[0] >= 1 else (1 - bucket[0]) / por_segundo)
+            if not any(esperas):
+                for bucket, (_, _, _, costo) in zip(estados, buckets):
+                    bucket[0] -= costo
+            return esperas
+
+
+class BucketsRedis:
+    """Buckets compartidos entre workers. La actualización es atómica gracias a un script Lua."""
+
+    SCRIPT = """
+    local ahora = tonumber(ARGV[1])
+    local tokens = {}
+    local esperas = {}
+    local permitido = true
+    for i = 1, #KEYS do
+        local capacidad = tonumber(ARGV[3 * i - 1])
+        local por_segundo = tonumber(ARGV[3 * i])
+        local estado = redis.call('HMGET', KEYS[i], 't', 'u')
+        local t = tonumber(estado[1]) or capacidad
+        local ultimo = tonumber(estado[2]) or ahora
+        t = math.min(capacidad, t + math.max(0, ahora - ultimo) * por_segundo)
+        if t >= 1 then
+            esperas[i] = 0
+        else
+            esperas[i] = (1 - t) / por_segundo
+            permitido = false
+        end
+        tokens[i] = t
+    end
+    for i = 1, #KEYS do
+        local capacidad = tonumber(ARGV[3 * i - 1])
+        local por_segundo = tonumber(ARGV[3 * i])
+        if permitido then
+            tokens[i] = tokens[i] - tonumber(ARGV[3 * i + 1])
+        end
+        redis.call('HSET', KEYS[i], 't', tokens[i], 'u', ahora)
+        redis.call('EXPIRE', KEYS[i], math.ceil(capacidad / por_segundo) + 1)
+        esperas[i] = tostring(esperas[i])
+    end
+    return esperas
+    """
+
+    def __init__(self, url: str):
+        import redis  # dependencia opcional, solo necesaria con LIMITE_REDIS_URL
+
+        self._cliente = redis.Redis.from_url(url)
+        self._script = self._cliente.register_script(self.SCRIPT)
+
+    def consumir(self, buckets: list) -> list:
+        argumentos = [time.time()]
+        for _, capacidad, por_segundo, costo in buckets:
+            argumentos += [capacidad, por_segundo, costo]
+        claves = [f"uscc:limite:{clave}" for clave, _, _, _ in buckets]
+        return [float(espera) for espera in self._script(keys=claves, args=argumentos)]
+
+
+_almacen = BucketsRedis(REDIS_URL) if REDIS_URL else BucketsMemoria(MAX_BUCKETS)
+
+
+class Limite:
+    """Un token bucket con nombre: `capacidad` intentos seguidos y `por_minuto` de recarga.
+
+    Con `solo_fallos` la petición solo comprueba el bucket; el token se gasta al llamar
+    a `registrar_fallo`.
+    """
+
+    def __init__(self, nombre: str, capacidad: int, por_minuto: float, solo_fallos: bool = False):
+        self.nombre = nombre
+        self.capacidad = capacidad
+        self.por_segundo = por_minuto / 60
+        self.solo_fallos = solo_fallos
+
+    def bucket(self, clave, costo: int = 1) -> tuple:
+        return (f"{self.nombre}:{clave}", self.capacidad, self.por_segundo, costo)
+
+
+LOGIN_POR_IDENTIFICACION = Limite(
+    "login_id",
+    int(os.getenv("LIMITE_LOGIN_ID_CAPACIDAD", "5")),
+    float(os.getenv("LIMITE_LOGIN_ID_POR_MINUTO", "1")),
+)
+LOGIN_POR_IP = Limite(
+    "login_ip",
+    int(os.getenv("LIMITE_LOGIN_IP_CAPACIDAD", "30")),
+    float(os.getenv("LIMITE_LOGIN_IP_POR_MINUTO", "30")),
+    solo_fallos=True,
+)
+REGISTRO_POR_IDENTIFICACION = Limite(
+    "registro_id",
+    int(os.getenv("LIMITE_REGISTRO_ID_CAPACIDAD", "3")),
+    float(os.getenv("LIMITE_REGISTRO_ID_POR_MINUTO", "1")),
+)
+# Holgado: al abrir el semestre se registran grupos enteros desde la misma sala
+REGISTRO_POR_IP = Limite(
+    "registro_ip",
+    int(os.getenv("LIMITE_REGISTRO_IP_CAPACIDAD", "60")),
+    float(os.getenv("LIMITE_REGISTRO_IP_POR_MINUTO", "30")),
+)
+
+
+def ip_cliente(request: Request) -> str:
+    if PROXIES_CONFIABLES > 0:
+        # Cada proxy añade al final la IP que le conectó; lo que está más a la izquierda
+        # lo escribe el cliente y no sirve para identificarlo
+        direcciones = [
+            direccion.strip()
+            for cabecera in request.headers.getlist("x-forwarded-for")
+            for direccion in cabecera.split(",")
+            if direccion.strip()
+        ]
+        if len(direcciones) >= PROXIES_CONFIABLES:
+            return direcciones[-PROXIES_CONFIABLES]
+    return request.client.host if request.client else "desconocida"
+
+
+def verificar(*limites):
+    """Consume un token de cada (limite, clave) solo si todos tienen. Lanza 429 si alguno está agotado.
+
+    Los límites `solo_fallos` se comprueban pero no se gastan aquí.
+    """
+    esperas = _almacen.consumir([limite.bucket(clave, 0 if limite.solo_fallos else 1) for limite, clave in limites])
+    for (limite, _), espera_limite in zip(limites, esperas):
+        if espera_limite > 0:
+            metricas.LIMITE_RECHAZOS.labels(limite.nombre).inc()
+    espera = max(esperas, default=0.0)
+    if espera > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados intentos, intente de nuevo más tarde",
+            headers={"Retry-After": str(int(espera) + 1)},
+        )
+
+
+def registrar_fallo(limite: Limite, clave):
+    """Gasta un token de un límite `solo_fallos` (p. ej. tras unas credenciales incorrectas)."""
+    _almacen.consumir([limite.bucket(clave)])
@@ -1,19 +1,31 @@
 
 import security
 import models
-import io
+import metricas
+import limitador
+import reportes
+import exportacion
+import idempotencia
+import auditoria
+import invalidacion
+from catalogo import catalogo
+import os
 
 from utilidades.time import hora_colombia
+from utilidades.consultas import middleware_consultas
+from utilidades.cache_lru import CacheLRU
 
-from openpyxl import Workbook
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
 
-from typing import Union, List, Annotated
-from fastapi import FastAPI, HTTPException, Depends, Response
+from typing import Union, List, Annotated, Optional
+from fastapi import FastAPI, HTTPException, Depends, Response, Request, Cookie, Header
 from pydantic import BaseModel, EmailStr, Field, HttpUrl
 from datetime import time, datetime
 from enum import Enum
-from database import engine, SessionLocal
+from database import engine, engine_lectura, SessionLocal, SessionLectura
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -24,6 +36,12 @@ from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
 
+# Gauges del pool de conexiones para /metrics. Antes de create_all: una conexión
+# abierta antes de registrar los eventos nunca se contaría
+metricas.instrumentar_engine(engine, "principal")
+if engine_lectura is not engine:
+    metricas.instrumentar_engine(engine_lectura, "replica")
+
 # Crea todas las tablas en la base de datos (PostgreSQL)
 models.Base.metadata.create_all(bind=engine)
 
@@ -42,6 +60,41 @@ def get_db():
 db_dependency = Annotated[Session, Depends(get_db)]
 
 
+# Segundos durante los que un usuario lee de la primaria tras escribir (0 desactiva "read-your-writes")
+SEGUNDOS_LEER_PROPIAS_ESCRITURAS = int(os.getenv("LEER_PROPIAS_ESCRITURAS", "10"))
+
+# Identificaciones que escribieron hace poco. La cookie no basta: con CORS sin credenciales
+# un frontend de otro origen no la guarda ni la envía. Este registro es de cada worker, así
+# que una lectura que caiga en otro worker solo queda cubierta por la cookie
+_escrituras_recientes = CacheLRU(int(os.getenv("LEER_PROPIAS_ESCRITURAS_MAX", "100000")), ttl=SEGUNDOS_LEER_PROPIAS_ESCRITURAS)
+
+def _escribio_hace_poco(request: Request) -> bool:
+    if request.cookies.get("escritura_reciente"):
+        return True
+    # Todas las lecturas afectadas reciben la identificación en la ruta o en la query
+    identificacion = request.path_params.get("identificacion") or request.query_params.get("identificacion")
+    return identificacion is not None and _escrituras_recientes.obtener(str(identificacion)) is not None
+
+# Conexion de solo lectura (réplica si está configurada) para catálogo y reportes
+def get_db_lectura(request: Request):
+    # Si el usuario acaba de inscribirse, la réplica podría no tener aún su escritura
+    if SEGUNDOS_LEER_PROPIAS_ESCRITURAS and _escribio_hace_poco(request):
+        db = SessionLocal()
+    else:
+        db = SessionLectura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def marcar_escritura_reciente(response: Response, identificacion: int):
+    # La cookie y la entrada del registro caducan solas: mientras existan, get_db_lectura usa la primaria
+    if SEGUNDOS_LEER_PROPIAS_ESCRITURAS:
+        _escrituras_recientes.guardar(str(identificacion), True)
+        response.set_cookie(key="escritura_reciente", value="1", max_age=SEGUNDOS_LEER_PROPIAS_ESCRITURAS, httponly=True, samesite="lax")
+
+
 app.add_middleware(
     CORSMiddleware,
     # Temporalmente permitir todos los orígenes para depuración. Revertir a origen específico en producción.
@@ -51,6 +104,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cuenta las consultas SQL de cada petición y avisa de posibles N+1 (ver utilidades/consultas.py)
+app.middleware("http")(middleware_consultas)
+
+# Latencias y códigos de estado por ruta para /metrics
+app.middleware("http")(metricas.middleware_metricas)
+
+
+
+
+# El escritor de auditoría corre en un hilo por worker; al apagar guarda lo pendiente
+@app.on_event("startup")
+def iniciar_auditoria():
+    auditoria.iniciar()
+
+@app.on_event("shutdown")
+def detener_auditoria():
+    auditoria.detener()
+
+# Cada worker escucha los eventos de invalidación de cachés (LISTEN/NOTIFY)
+@app.on_event("startup")
+def iniciar_invalidacion():
+    invalidacion.iniciar()
+
+@app.on_event("shutdown")
+def detener_invalidacion():
+    invalidacion.detener()
 
 
 
@@ -60,6 +139,14 @@ def read_root():
 
 
 
+# Ruta para exponer las métricas en formato Prometheus
+@app.get("/metrics", include_in_schema=False)
+def exponer_metricas():
+    contenido, content_type = metricas.exportar()
+    return Response(content=contenido, media_type=content_type)
+
+
+
 """
 Diferencia entre códigos de status_code:
 
@@ -82,8 +169,15 @@ class UsuarioRegistrar(BaseModel):
     correo: EmailStr
     contrasena: str = Field(..., min_length=8)
 
+# Limita los registros por IP y por identificación antes de consultar la BD o hashear la contraseña
+def limitar_registro(usuario: UsuarioRegistrar, request: Request):
+    limitador.verificar(
+        (limitador.REGISTRO_POR_IP, limitador.ip_cliente(request)),
+        (limitador.REGISTRO_POR_IDENTIFICACION, usuario.identificacion),
+    )
+
 # Ruta para registrar un nuevo usuario
-@app.post("/registrar_usuario")
+@app.post("/registrar_usuario", dependencies=[Depends(limitar_registro)])
 def registrar_usuario(usuario: UsuarioRegistrar, db: Session = Depends(get_db)):
     # Busca en la db si el usuario ya existe por identificación o correo
     existe = db.query(models.Usuario).filter(
@@ -114,13 +208,22 @@ class UsuarioLogin(BaseModel):
     identificacion: int
     contrasena: str
 
+# Limita los intentos por IP y por identificación antes de consultar la BD o verificar el hash.
+# El límite por IP solo gasta tokens con credenciales incorrectas (ver limitador.py)
+def limitar_inicio_sesion(credenciales: UsuarioLogin, request: Request):
+    limitador.verificar(
+        (limitador.LOGIN_POR_IP, limitador.ip_cliente(request)),
+        (limitador.LOGIN_POR_IDENTIFICACION, credenciales.identificacion),
+    )
+
 # Ruta para iniciar sesión (ahora emite JWT)
-@app.post("/iniciar_sesion")
-def iniciar_sesion(credenciales: UsuarioLogin, response: Response, db: Session = Depends(get_db)):
+@app.post("/iniciar_sesion", dependencies=[Depends(limitar_inicio_sesion)])
+def iniciar_sesion(credenciales: UsuarioLogin, request: Request, response: Response, db: Session = Depends(get_db)):
     # Busca en la BD si el usuario existe por identificación
     existe_usuario = db.query(models.Usuario).filter(models.Usuario.identificacion == credenciales.identificacion).first()
     # Verificamos la contraseña contra el hash almacenado
     if not existe_usuario or not security.verify_password(credenciales.contrasena, existe_usuario.contrasena):
+        limitador.registrar_fallo(limitador.LOGIN_POR_IP, limitador.ip_cliente(request))
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
     # Construimos la información que devolveremos al frontend
@@ -148,7 +251,18 @@ def iniciar_sesion(credenciales: UsuarioLogin, response: Response, db: Session =
     }
 
     access_token = security.create_access_token(token_payload)
+    # El refresh token permite renovar el access token sin volver a verificar la contraseña
+    refresh_token = security.create_refresh_token(db, token_payload, existe_usuario.id)
+    db.commit()
+
+    guardar_cookies_sesion(response, access_token, refresh_token)
 
+    # Devolvemos el token y la info del usuario (frontend puede preferir usar solo la cookie)
+    return {"msg": "Inicio de sesión exitoso", **usuario_info, "access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+
+def guardar_cookies_sesion(response: Response, access_token: str, refresh_token: str):
     # Opcional: establecer cookie HttpOnly (más segura que exponer token en localStorage)
     # En producción configurar `secure=True` y usar HTTPS
     response.set_cookie(
@@ -159,79 +273,96 @@ def iniciar_sesion(credenciales: UsuarioLogin, response: Response, db: Session =
         samesite="lax",
         max_age=security.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
     )
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        secure=False,
+        samesite="lax",
+        max_age=security.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60,
+    )
 
-    # Devolvemos el token y la info del usuario (frontend puede preferir usar solo la cookie)
-    return {"msg": "Inicio de sesión exitoso", **usuario_info, "access_token": access_token, "token_type": "bearer"}
+
+
+# Modelo para renovar o revocar un refresh token (también se acepta en la cookie "refresh_token")
+class SolicitudRefresco(BaseModel):
+    refresh_token: Optional[str] = None
+
+def _refresh_token_de(solicitud: Optional[SolicitudRefresco], cookie: Optional[str]) -> str:
+    token = (solicitud.refresh_token if solicitud else None) or cookie
+    if not token:
+        raise HTTPException(status_code=401, detail="Falta el refresh token")
+    return token
+
+# Ruta para renovar el access token sin volver a iniciar sesión
+@app.post("/refrescar_token")
+def refrescar_token(response: Response, solicitud: Optional[SolicitudRefresco] = None, refresh_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)):
+    # Solo verifica la firma y busca el jti; el refresh token usado queda revocado (rotación)
+    access_token, nuevo_refresh_token = security.rotate_refresh_token(db, _refresh_token_de(solicitud, refresh_token))
+    guardar_cookies_sesion(response, access_token, nuevo_refresh_token)
+    return {"access_token": access_token, "refresh_token": nuevo_refresh_token, "token_type": "bearer"}
+
+# Ruta para cerrar sesión: revoca el refresh token y borra las cookies
+@app.post("/cerrar_sesion")
+def cerrar_sesion(response: Response, solicitud: Optional[SolicitudRefresco] = None, refresh_token: Optional[str] = Cookie(None), db: Session = Depends(get_db)):
+    # Las cookies se borran siempre: con un token vencido o inválido no hay nada que revocar
+    token = (solicitud.refresh_token if solicitud else None) or refresh_token
+    if token:
+        try:
+            security.revoke_refresh_token(db, token)
+        except HTTPException:
+            pass
+    response.delete_cookie("access_token")
+    response.delete_cookie("refresh_token")
+    return {"msg": "Sesión cerrada correctamente"}
 
 
 
-# Ruta para los cursos
+# Ruta para los cursos (servida desde el snapshot en memoria, ver catalogo.py)
 @app.get('/cursos')
-def listar_cursos(db: Session = Depends(get_db)):
-    cursos = db.query(models.Curso).all()
-
-    lista_cursos = []
-    for c in cursos:
-        lista_cursos.append({
-            'id': c.id,
-            'nombre': c.nombre,
-            'descripcion': c.descripcion,
-            'tipo_curso': c.tipo_curso,
-            'imagen': getattr(c, 'imagen', None),
-            'activo': getattr(c, 'activo', True)
-        })
-    return lista_cursos
+def listar_cursos():
+    return catalogo.listar_cursos()
 
 
 
 # Ruta para obtener los horarios de un curso específico
 @app.get('/cursos/{curso_id}/horario')
-def obtener_horarios_curso(curso_id: int, identificacion: int, db: Session = Depends(get_db)):
-    # Buscamos el curso y comprobamos existencia
-    curso = db.query(models.Curso).filter(models.Curso.id == curso_id).first()
+def obtener_horarios_curso(curso_id: int, identificacion: int, db: Session = Depends(get_db_lectura)):
+    # Los datos del curso y sus horarios salen del snapshot en memoria
+    curso = catalogo.obtener_curso(curso_id)
     if not curso:
         raise HTTPException(status_code=404, detail='Curso no encontrado')
 
-    # Estado del curso (botón global): si el curso está desactivado, no dejar inscribir
-    curso_activo = bool(getattr(curso, 'activo', True))
-
-    # Traemos los horarios asociados al curso (todos) y los iteramos
-    horarios_q = db.query(models.Horario).filter(models.Horario.curso_id == curso_id).all()
-    horarios = []
-
-
-    usuario = db.query(models.Usuario).filter(models.Usuario.identificacion == identificacion).first()
-    if not usuario:
+    # Una sola consulta trae lo que cambia con cada inscripción: cupo disponible y si el usuario
+    # está inscrito en cada horario. Si no hay filas es que el usuario no existe
+    filas = db.query(
+        models.Usuario.id, models.Horario.id, models.Horario.cupo_disponible, models.Inscripcion.id
+    ).select_from(models.Usuario).outerjoin(
+        models.Horario, models.Horario.curso_id == curso_id
+    ).outerjoin(
+        models.Inscripcion, and_(models.Inscripcion.horario_id == models.Horario.id, models.Inscripcion.usuario_id == models.Usuario.id)
+    ).filter(models.Usuario.identificacion == identificacion).all()
+    if not filas:
         raise HTTPException(status_code=404, detail='Usuario no encontrado')
 
+    en_vivo = {f[1]: (f[2], f[3] is not None) for f in filas if f[1] is not None}
+    # Si otro worker añadió o borró horarios y aún no lo vemos, recargamos solo este curso
+    if set(en_vivo) != {h.id for h in curso.horarios}:
+        curso = catalogo.recargar_curso(curso_id) or curso
 
-
-    for hor in horarios_q:
-        # Determinar si el horario está activo
-        horario_activo = bool(getattr(hor, 'activo', True))
-
-        # Cupo disponible
-        cupo_disponible = getattr(hor, 'cupo_disponible', None)
-
-        # Validamos si el usuario ya está inscrito en este horario
-        # Por defecto: usuario no inscrito
-        inscrito = False
-        if usuario:
-            existe = db.query(models.Inscripcion).filter(
-                models.Inscripcion.horario_id == hor.id,
-                models.Inscripcion.usuario_id == usuario.id
-            ).first()
-            inscrito = True if existe else False
-
-
+    horarios = []
+    for hor in curso.horarios:
+        if hor.id not in en_vivo:
+            continue
+        cupo_disponible, inscrito = en_vivo[hor.id]
         horarios.append({
             'id': hor.id,
-            'dia': hor.dia.value if hasattr(hor.dia, 'value') else str(hor.dia),
-            'hora_inicio': hor.hora_inicio.isoformat() if hor.hora_inicio else None,
-            'hora_fin': hor.hora_fin.isoformat() if hor.hora_fin else None,
+            'dia': hor.dia,
+            'hora_inicio': hor.hora_inicio,
+            'hora_fin': hor.hora_fin,
             'profesor': hor.profesor,
             'cupo_disponible': cupo_disponible,
-            'activo_horario': horario_activo,
+            'activo_horario': hor.activo,
             'inscrito': inscrito
         })
 
@@ -240,25 +371,30 @@ def obtener_horarios_curso(curso_id: int, identificacion: int, db: Session = Dep
 
 
 # Ruta para inscribirse o cancelar la inscripción en un horario de un curso
+# (alterna el estado: un reintento puede deshacer la operación; los clientes nuevos deben usar /inscribir y /cancelar)
 @app.post('/horario/{horario_id},{curso_id}/inscripcion')
-def gestionar_inscripcion(horario_id: int, curso_id: int, identificacion: int, db: Session = Depends(get_db)):
+def gestionar_inscripcion(horario_id: int, curso_id: int, identificacion: int, response: Response, db: Session = Depends(get_db)):
     # Verificamos que el usuario exista
     usuario = db.query(models.Usuario).filter(models.Usuario.identificacion == identificacion).first()
     if not usuario:
+        metricas.INSCRIPCIONES.labels("usuario_no_encontrado").inc()
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     # Verificamos que el horario exista
     horario = db.query(models.Horario).filter(models.Horario.id == horario_id).first()
     if not horario:
+        metricas.INSCRIPCIONES.labels("horario_no_encontrado").inc()
         raise HTTPException(status_code=404, detail="Horario no encontrado")
     
     # Verificamos que el curso asociado al horario esté activo
     curso = db.query(models.Curso).filter(models.Curso.id == horario.curso_id).first()
     if not curso or not getattr(curso, 'activo', True):
+        metricas.INSCRIPCIONES.labels("curso_inactivo").inc()
         raise HTTPException(status_code=400, detail="El curso asociado al horario no está activo")
     
     # Verificamos que el horario esté activo
     if not getattr(horario, 'activo', True):
+        metricas.INSCRIPCIONES.labels("horario_inactivo").inc()
         raise HTTPException(status_code=400, detail="El horario no está activo")
     
     # Verificamos si el usuario ya está inscrito en este horario
@@ -270,14 +406,20 @@ def gestionar_inscripcion(horario_id: int, curso_id: int, identificacion: int, d
     if inscripcion_existente:
         # Si ya está inscrito, procedemos a cancelar la inscripción
         db.delete(inscripcion_existente)
-        # Incrementamos el cupo disponible si es aplicable
+        # Incrementamos el cupo disponible si es aplicable (en SQL: dos cancelaciones simultáneas no se pisan)
         if horario.cupo_disponible is not None:
-            horario.cupo_disponible += 1
+            horario.cupo_disponible = models.Horario.cupo_disponible + 1
         db.commit()
+        metricas.INSCRIPCIONES.labels("cancelado").inc()
+        auditoria.registrar(models.TipoEventoAuditoria.cancelacion, usuario_id=usuario.id, horario_id=horario.id, curso_id=horario.curso_id)
+        marcar_escritura_reciente(response, identificacion)
         return {"msg": "Inscripción cancelada correctamente"}
     else:
-        # Si no está inscrito, verificamos si hay cupo disponible para inscribir
-        if horario.cupo_disponible is not None and horario.cupo_disponible <= 0:
+        # Si no está inscrito, reservamos el cupo con un UPDATE atómico: leer el cupo y
+        # restarle uno en Python dejaba inscribir a más usuarios que cupos en la carrera
+        if horario.cupo_disponible is not None and reservar_cupos(db, [horario.id]):
+            db.rollback()
+            metricas.INSCRIPCIONES.labels("sin_cupo").inc()
             raise HTTPException(status_code=400, detail="No hay cupo disponible en este horario")
         
         # Procedemos a inscribir al usuario
@@ -287,12 +429,188 @@ def gestionar_inscripcion(horario_id: int, curso_id: int, identificacion: int, d
             fecha_inscripcion=hora_colombia(),
         )
         db.add(nueva_inscripcion)
-        # Decrementamos el cupo disponible si es aplicable
-        if horario.cupo_disponible is not None:
-            horario.cupo_disponible -= 1
+        try:
+            db.commit()
+        except IntegrityError:
+            # Una petición simultánea del mismo usuario ya lo inscribió: el rollback devuelve el cupo
+            db.rollback()
+            metricas.INSCRIPCIONES.labels("ya_inscrito").inc()
+            raise HTTPException(status_code=409, detail="El usuario ya está inscrito en este horario")
+        metricas.INSCRIPCIONES.labels("inscrito").inc()
+        auditoria.registrar(models.TipoEventoAuditoria.inscripcion, usuario_id=usuario.id, horario_id=horario.id, curso_id=horario.curso_id)
+        marcar_escritura_reciente(response, identificacion)
+        return {"msg": "Inscripción realizada correctamente"}
+
+
+
+
+# Valida usuario, horarios, cursos y estados activos con una sola consulta.
+# Devuelve el id interno del usuario, los horarios en los que ya está inscrito y el curso de cada horario.
+def validar_inscripcion(db: Session, identificacion: int, horario_ids: List[int]):
+    usuario_id = db.query(models.Usuario.id).filter(models.Usuario.identificacion == identificacion).scalar_subquery()
+    filas = db.query(
+        models.Horario.id,
+        models.Horario.activo,
+        models.Curso.activo,
+        usuario_id.label("usuario_id"),
+        models.Inscripcion.id,
+        models.Curso.id,
+    ).join(
+        models.Curso, models.Curso.id == models.Horario.curso_id
+    ).outerjoin(
+        models.Inscripcion, and_(models.Inscripcion.horario_id == models.Horario.id, models.Inscripcion.usuario_id == usuario_id)
+    ).filter(models.Horario.id.in_(horario_ids)).all()
+
+    no_encontrados = sorted(set(horario_ids) - {f[0] for f in filas})
+    if no_encontrados:
+        metricas.INSCRIPCIONES.labels("horario_no_encontrado").inc()
+        raise HTTPException(status_code=404, detail={"msg": "Horario no encontrado", "horario_ids": no_encontrados})
+    if filas[0][3] is None:
+        metricas.INSCRIPCIONES.labels("usuario_no_encontrado").inc()
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    cursos_inactivos = [f[0] for f in filas if not f[2]]
+    if cursos_inactivos:
+        metricas.INSCRIPCIONES.labels("curso_inactivo").inc()
+        raise HTTPException(status_code=400, detail={"msg": "El curso asociado al horario no está activo", "horario_ids": cursos_inactivos})
+    horarios_inactivos = [f[0] for f in filas if not f[1]]
+    if horarios_inactivos:
+        metricas.INSCRIPCIONES.labels("horario_inactivo").inc()
+        raise HTTPException(status_code=400, detail={"msg": "El horario no está activo", "horario_ids": horarios_inactivos})
+
+    return filas[0][3], [f[0] for f in filas if f[4] is not None], {f[0]: f[5] for f in filas}
+
+
+# Reserva un cupo en cada horario con un único UPDATE atómico (solo descuenta donde aún queda cupo).
+# Devuelve los horarios sin cupo; si hay alguno el llamador debe hacer rollback.
+def reservar_cupos(db: Session, horario_ids: List[int]) -> List[int]:
+    tabla_horario = models.Horario.__table__
+    reservados = db.execute(
+        tabla_horario.update()
+        .where(tabla_horario.c.id.in_(horario_ids), tabla_horario.c.cupo_disponible > 0, tabla_horario.c.activo.is_(True))
+        .values(cupo_disponible=tabla_horario.c.cupo_disponible - 1)
+        .returning(tabla_horario.c.id)
+    ).scalars().all()
+    return sorted(set(horario_ids) - set(reservados))
+
+
+
+# Modelo para inscribirse en varios horarios a la vez
+class InscripcionLote(BaseModel):
+    identificacion: int
+    horario_ids: List[int]
+
+# Ruta para inscribirse en varios horarios en una sola transacción (todo o nada)
+@app.post('/inscripciones/lote')
+def inscribir_lote(lote: InscripcionLote, response: Response, db: Session = Depends(get_db)):
+    horario_ids = sorted(set(lote.horario_ids))
+    if not horario_ids:
+        raise HTTPException(status_code=400, detail="Debe indicar al menos un horario")
+
+    id_usuario, ya_inscritos, cursos = validar_inscripcion(db, lote.identificacion, horario_ids)
+    if ya_inscritos:
+        metricas.INSCRIPCIONES.labels("ya_inscrito").inc()
+        raise HTTPException(status_code=400, detail={"msg": "El usuario ya está inscrito en estos horarios", "horario_ids": ya_inscritos})
+
+    sin_cupo = reservar_cupos(db, horario_ids)
+    if sin_cupo:
+        db.rollback()
+        metricas.INSCRIPCIONES.labels("sin_cupo").inc()
+        raise HTTPException(status_code=400, detail={"msg": "No hay cupo disponible en estos horarios", "horario_ids": sin_cupo})
+
+    fecha = hora_colombia()
+    try:
+        db.execute(models.Inscripcion.__table__.insert(), [
+            {"horario_id": horario_id, "usuario_id": id_usuario, "fecha_inscripcion": fecha}
+            for horario_id in horario_ids
+        ])
         db.commit()
+    except IntegrityError:
+        # Otra petición simultánea inscribió al usuario en alguno de estos horarios
+        db.rollback()
+        metricas.INSCRIPCIONES.labels("ya_inscrito").inc()
+        raise HTTPException(status_code=409, detail="El usuario ya está inscrito en alguno de estos horarios")
+
+    metricas.INSCRIPCIONES.labels("inscrito").inc(len(horario_ids))
+    for horario_id in horario_ids:
+        auditoria.registrar(models.TipoEventoAuditoria.inscripcion, usuario_id=id_usuario, horario_id=horario_id, curso_id=cursos[horario_id], lote=True)
+    marcar_escritura_reciente(response, lote.identificacion)
+    return {"msg": "Inscripciones realizadas correctamente", "horario_ids": horario_ids}
+
+
+
+
+# Responde con el resultado de una operación idempotente (ver idempotencia.py)
+def responder_idempotente(clave: Optional[str], huella: tuple, identificacion: int, operacion):
+    estado, cuerpo, repetido = idempotencia.ejecutar(clave, huella, operacion)
+    respuesta = JSONResponse(status_code=estado, content=cuerpo)
+    if repetido:
+        respuesta.headers["Idempotent-Replayed"] = "true"
+    if estado == 200:
+        marcar_escritura_reciente(respuesta, identificacion)
+    return respuesta
+
+
+
+# Ruta para inscribirse en un horario. A diferencia de /horario/{horario_id},{curso_id}/inscripcion
+# nunca cancela: si el usuario ya está inscrito responde éxito sin escribir, así que es seguro reintentar
+@app.post('/horario/{horario_id}/inscribir')
+def inscribir(horario_id: int, identificacion: int, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    def operacion():
+        id_usuario, ya_inscritos, cursos = validar_inscripcion(db, identificacion, [horario_id])
+        if ya_inscritos:
+            return {"msg": "El usuario ya estaba inscrito en este horario"}
+
+        if reservar_cupos(db, [horario_id]):
+            db.rollback()
+            metricas.INSCRIPCIONES.labels("sin_cupo").inc()
+            raise HTTPException(status_code=400, detail="No hay cupo disponible en este horario")
+        try:
+            db.add(models.Inscripcion(horario_id=horario_id, usuario_id=id_usuario, fecha_inscripcion=hora_colombia()))
+            db.commit()
+        except IntegrityError:
+            # Una petición simultánea ya lo inscribió: el cupo reservado aquí se devuelve con el rollback
+            db.rollback()
+            return {"msg": "El usuario ya estaba inscrito en este horario"}
+        metricas.INSCRIPCIONES.labels("inscrito").inc()
+        auditoria.registrar(models.TipoEventoAuditoria.inscripcion, usuario_id=id_usuario, horario_id=horario_id, curso_id=cursos[horario_id])
         return {"msg": "Inscripción realizada correctamente"}
 
+    return responder_idempotente(idempotency_key, ("inscribir", horario_id, identificacion), identificacion, operacion)
+
+
+
+# Ruta para cancelar la inscripción en un horario. Si el usuario no estaba inscrito responde éxito sin escribir
+@app.post('/horario/{horario_id}/cancelar')
+def cancelar_inscripcion(horario_id: int, identificacion: int, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    def operacion():
+        id_usuario, ya_inscritos, cursos = validar_inscripcion(db, identificacion, [horario_id])
+        if not ya_inscritos:
+            return {"msg": "El usuario no estaba inscrito en este horario"}
+
+        # Solo devolvemos el cupo si este DELETE fue el que borró la inscripción
+        tabla_inscripcion = models.Inscripcion.__table__
+        borrada = db.execute(
+            tabla_inscripcion.delete()
+            .where(tabla_inscripcion.c.horario_id == horario_id, tabla_inscripcion.c.usuario_id == id_usuario)
+            .returning(tabla_inscripcion.c.id)
+        ).first()
+        if borrada is None:
+            db.rollback()
+            return {"msg": "El usuario no estaba inscrito en este horario"}
+        tabla_horario = models.Horario.__table__
+        db.execute(
+            tabla_horario.update()
+            .where(tabla_horario.c.id == horario_id)
+            .values(cupo_disponible=tabla_horario.c.cupo_disponible + 1)
+        )
+        db.commit()
+        metricas.INSCRIPCIONES.labels("cancelado").inc()
+        auditoria.registrar(models.TipoEventoAuditoria.cancelacion, usuario_id=id_usuario, horario_id=horario_id, curso_id=cursos[horario_id])
+        return {"msg": "Inscripción cancelada correctamente"}
+
+    return responder_idempotente(idempotency_key, ("cancelar", horario_id, identificacion), identificacion, operacion)
+
 
 
 
@@ -309,7 +627,7 @@ def gestionar_inscripcion(horario_id: int, curso_id: int, identificacion: int, d
 
 # Ruta para reporte de cursos, horarios, inscripciones y usuarios
 @app.get("/reporte_cursos/{identificacion}")
-def reporte_cursos(identificacion: int, tipo_curso: Union[models.TipoCurso, None] = None,  db: Session = Depends(get_db)):
+def reporte_cursos(identificacion: int, tipo_curso: Union[models.TipoCurso, None] = None,  db: Session = Depends(get_db_lectura)):
     query = db.query(models.Curso)
     if tipo_curso:
         query = query.filter(models.Curso.tipo_curso == tipo_curso)
@@ -355,76 +673,87 @@ def reporte_cursos(identificacion: int, tipo_curso: Union[models.TipoCurso, None
 
 
 
+# Tiempo máximo que la descarga síncrona espera a que termine el trabajo de generación
+SEGUNDOS_ESPERA_REPORTE = int(os.getenv("REPORTES_SEGUNDOS_ESPERA", "300"))
+
 @app.get("/reporte_cursos/{identificacion}/excel")
-def reporte_cursos_excel(identificacion: int, tipo_curso: Union[models.TipoCurso, None] = None, db: Session = Depends(get_db)):
-    """Genera un archivo Excel (.xlsx) con el mismo contenido que devuelve `/reporte_cursos`.
-    Se crea una hoja por curso; cada fila representa un horario y sus inscripciones (si las hay).
-    Devuelve un StreamingResponse con el archivo para descarga.
+def reporte_cursos_excel(identificacion: int, tipo_curso: Union[models.TipoCurso, None] = None, db: Session = Depends(get_db_lectura)):
+    """Devuelve un archivo Excel (.xlsx) con el mismo contenido que `/reporte_cursos`.
+    Si los datos no han cambiado se reutiliza el archivo ya generado; si otra petición lo está
+    generando se espera a ese trabajo (ver reportes.py).
     """
-    query = db.query(models.Curso)
-    if tipo_curso:
-        query = query.filter(models.Curso.tipo_curso == tipo_curso)
+    clave, estado = reportes.solicitar(db, tipo_curso)
+    if estado != reportes.LISTO:
+        estado = reportes.esperar(clave, SEGUNDOS_ESPERA_REPORTE)
+    if estado == reportes.ERROR:
+        raise HTTPException(status_code=500, detail="Error generando el reporte")
+    if estado != reportes.LISTO:
+        raise HTTPException(status_code=503, detail="El reporte sigue generándose, intente más tarde")
 
-    cursos = query.all()
+    filename = f"reporte_cursos_{identificacion}.xlsx"
+    return FileResponse(reportes.ruta_artefacto(clave), media_type=reportes.MEDIA_TYPE_EXCEL, filename=filename)
 
-    wb = Workbook()
-    # Si hay al menos un curso, eliminamos la hoja por defecto y creamos por curso
-    if cursos:
-        # eliminar hoja por defecto
-        default = wb.active
-        wb.remove(default)
-
-        for curso in cursos:
-            # sheet title max 31 chars
-            title = f"{curso.id}_{curso.nombre}"[:31]
-            ws = wb.create_sheet(title=title)
-            # Encabezados
-            ws.append(["Dia", "Hora Inicio", "Hora Fin", "Profesor", "Cantidad Matriculados", "Usuario Nombre", "Identificacion", "Correo", "Fecha Inscripcion"])
-
-            for horario in curso.horario:
-                cantidad = len(horario.inscripcion) if horario.inscripcion else 0
-                # Si hay inscripciones, escribir una fila por cada inscripcion
-                if horario.inscripcion:
-                    for inscripcion in horario.inscripcion:
-                        usuario = db.query(models.Usuario).filter(models.Usuario.id == inscripcion.usuario_id).first()
-                        ws.append([
-                            horario.dia.value if hasattr(horario.dia, 'value') else str(horario.dia),
-                            horario.hora_inicio.isoformat() if horario.hora_inicio else None,
-                            horario.hora_fin.isoformat() if horario.hora_fin else None,
-                            horario.profesor,
-                            cantidad,
-                            usuario.nombre_apellido if usuario else None,
-                            usuario.identificacion if usuario else None,
-                            usuario.correo if usuario else None,
-                            inscripcion.fecha_inscripcion.isoformat() if inscripcion.fecha_inscripcion else None
-                        ])
-                else:
-                    # Sin inscripciones, una sola fila con columnas de usuario vacías
-                    ws.append([
-                        horario.dia.value if hasattr(horario.dia, 'value') else str(horario.dia),
-                        horario.hora_inicio.isoformat() if horario.hora_inicio else None,
-                        horario.hora_fin.isoformat() if horario.hora_fin else None,
-                        horario.profesor,
-                        cantidad,
-                        None,
-                        None,
-                        None,
-                        None
-                    ])
-    else:
-        # Sin cursos: dejar una hoja con un mensaje
-        ws = wb.active
-        ws.title = "Reporte"
-        ws.append(["No hay cursos para el filtro especificado"]) 
 
-    # Guardar en buffer y devolver como streaming
-    stream = io.BytesIO()
-    wb.save(stream)
-    stream.seek(0)
 
-    filename = f"reporte_cursos_{identificacion}.xlsx"
+# Ruta para solicitar la generación del reporte Excel en segundo plano
+@app.post("/reporte_cursos/{identificacion}/excel/trabajos", status_code=202)
+def solicitar_reporte_excel(identificacion: int, tipo_curso: Union[models.TipoCurso, None] = None, db: Session = Depends(get_db_lectura)):
+    # Solicitudes idénticas devuelven el mismo trabajo_id mientras los datos no cambien
+    clave, estado = reportes.solicitar(db, tipo_curso)
+    return {"trabajo_id": clave, "estado": estado}
+
+
+
+# Ruta para consultar el estado de un trabajo de reporte
+@app.get("/reporte_cursos/trabajos/{trabajo_id}")
+def estado_reporte_excel(trabajo_id: str):
+    estado = reportes.estado(trabajo_id) if reportes.clave_valida(trabajo_id) else None
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    respuesta = {"trabajo_id": trabajo_id, "estado": estado}
+    if estado == reportes.ERROR:
+        respuesta["error"] = reportes.detalle_error(trabajo_id)
+    return respuesta
+
+
+
+# Ruta para descargar el resultado de un trabajo de reporte
+@app.get("/reporte_cursos/trabajos/{trabajo_id}/descarga")
+def descargar_reporte_excel(trabajo_id: str):
+    estado = reportes.estado(trabajo_id) if reportes.clave_valida(trabajo_id) else None
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if estado != reportes.LISTO:
+        raise HTTPException(status_code=409, detail=f"El reporte no está listo (estado: {estado})")
+    return FileResponse(reportes.ruta_artefacto(trabajo_id), media_type=reportes.MEDIA_TYPE_EXCEL, filename=f"{trabajo_id}.xlsx")
+
+
+
+
+
+
+
+
+
+
+# Ruta para exportar todas las inscripciones en CSV (generado por Postgres con COPY)
+@app.get("/exportar/inscripciones.csv")
+def exportar_inscripciones_csv(tipo_curso: Union[models.TipoCurso, None] = None):
+    filename = f"inscripciones_{tipo_curso.name if tipo_curso else 'todos'}.csv"
     headers = {"Content-Disposition": f"attachment; filename={filename}"}
-    return StreamingResponse(stream, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+    return StreamingResponse(exportacion.stream_csv(tipo_curso), media_type="text/csv", headers=headers)
+
+
+
+# Ruta para exportar todas las inscripciones en Parquet (requiere pyarrow)
+@app.get("/exportar/inscripciones.parquet")
+def exportar_inscripciones_parquet(tipo_curso: Union[models.TipoCurso, None] = None):
+    if not exportacion.disponible_parquet():
+        raise HTTPException(status_code=501, detail="Exportación Parquet no disponible (falta pyarrow)")
+    ruta = exportacion.escribir_parquet(tipo_curso)
+    filename = f"inscripciones_{tipo_curso.name if tipo_curso else 'todos'}.parquet"
+    # El archivo temporal se borra cuando termina de enviarse
+    return FileResponse(ruta, media_type="application/vnd.apache.parquet", filename=filename, background=BackgroundTask(os.remove, ruta))
 
 
 
@@ -456,8 +785,12 @@ def registrar_curso(curso: RegistrarCurso, db: Session = Depends(get_db)):
     )
     # Añade el nuevo curso a la sesión de la BD
     db.add(nuevo_curso) # Añade el nuevo curso a la sesion de la BD
+    db.flush() # Asigna el id del curso antes de publicar el cambio
+    version = catalogo.registrar_cambio(db, nuevo_curso.id) # Invalida los reportes y el catálogo de los demás workers
     db.commit() # Guarda los cambios en la BD
     db.refresh(nuevo_curso)  #Actualiza el objeto nuevo_usuario con los datos de la BD
+    auditoria.registrar(models.TipoEventoAuditoria.curso_creado, curso_id=nuevo_curso.id, nombre=nuevo_curso.nombre)
+    catalogo.aplicar_cambio(db, nuevo_curso.id, version)
     return {"msg": "Curso registrado correctamente", "curso_id": nuevo_curso.id}
 
 
@@ -494,8 +827,11 @@ def registrar_horario(horario: RegistrarHorario, db: Session = Depends(get_db)):
 
     # Añade el nuevo horario a la sesión de la BD
     db.add(nuevo_horario) # Añade el nuevo horario a la sesion de la BD
+    version = catalogo.registrar_cambio(db, horario.curso_id) # Invalida los reportes y el catálogo de los demás workers
     db.commit() # Guarda los cambios en la BD
     db.refresh(nuevo_horario)  #Actualiza el objeto nuevo_horario con los datos de la BD
+    auditoria.registrar(models.TipoEventoAuditoria.horario_creado, horario_id=nuevo_horario.id, curso_id=nuevo_horario.curso_id)
+    catalogo.aplicar_cambio(db, nuevo_horario.curso_id, version)
     return {"msg": "Horario registrado correctamente", "horario_id": nuevo_horario.id}
 
 
@@ -510,15 +846,20 @@ def eliminar_curso(curso_id: int, db: Session = Depends(get_db)):
     
     # Busca horarios asociados al curso
     horarios_asociados = db.query(models.Horario).filter(models.Horario.curso_id == curso_id).all()
+    inscripciones_eliminadas = 0
     for horario in horarios_asociados:
         # Elimina inscripciones asociadas a cada horario
-        db.query(models.Inscripcion).filter(models.Inscripcion.horario_id == horario.id).delete()
+        inscripciones_eliminadas += db.query(models.Inscripcion).filter(models.Inscripcion.horario_id == horario.id).delete()
         # Elimina el horario
         db.delete(horario)
 
     # Elimina el curso
+    nombre_curso = curso_existente.nombre
     db.delete(curso_existente)
+    version = catalogo.registrar_cambio(db, curso_id) # Invalida los reportes y el catálogo de los demás workers
     db.commit()  # Guarda los cambios en la BD
+    auditoria.registrar(models.TipoEventoAuditoria.curso_eliminado, curso_id=curso_id, nombre=nombre_curso, horarios_eliminados=len(horarios_asociados), inscripciones_eliminadas=inscripciones_eliminadas)
+    catalogo.aplicar_cambio(db, curso_id, version)
     return {"msg": "Curso eliminado correctamente", "curso_id": curso_id}
 
 
@@ -532,11 +873,15 @@ def eliminar_horario(horario_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Horario no encontrado")
     
     # Elimina inscripciones asociadas al horario
-    db.query(models.Inscripcion).filter(models.Inscripcion.horario_id == horario_id).delete()
+    inscripciones_eliminadas = db.query(models.Inscripcion).filter(models.Inscripcion.horario_id == horario_id).delete()
     
     # Elimina el horario
+    curso_id = horario_existente.curso_id
     db.delete(horario_existente)
+    version = catalogo.registrar_cambio(db, curso_id) # Invalida los reportes y el catálogo de los demás workers
     db.commit()  # Guarda los cambios en la BD
+    auditoria.registrar(models.TipoEventoAuditoria.horario_eliminado, horario_id=horario_id, curso_id=curso_id, inscripciones_eliminadas=inscripciones_eliminadas)
+    catalogo.aplicar_cambio(db, curso_id, version)
     return {"msg": "Horario eliminado correctamente", "horario_id": horario_id}
 
 
@@ -556,9 +901,12 @@ def modificar_curso(curso_id: int, curso: RegistrarCurso, db: Session = Depends(
     curso_existente.imagen = str(curso.imagen)
 
     curso_existente.activo = curso.activo
+    version = catalogo.registrar_cambio(db, curso_existente.id) # Invalida los reportes y el catálogo de los demás workers
 
     db.commit()  # Guarda los cambios en la BD
     db.refresh(curso_existente)  # Actualiza el objeto con los datos de la BD
+    auditoria.registrar(models.TipoEventoAuditoria.curso_modificado, curso_id=curso_existente.id, nombre=curso_existente.nombre, activo=curso_existente.activo)
+    catalogo.aplicar_cambio(db, curso_existente.id, version)
     return {"msg": "Curso modificado correctamente", "curso_id": curso_existente.id}
 
 
@@ -574,10 +922,15 @@ def modificar_rol(identificacion: int, nuevo_rol: str, nuevo_area: str, db: Sess
     # Verifica si usuario ya tiene el rol de administrativo
     administrativo_existente = db.query(models.Administrativo).filter(models.Administrativo.id == usuario_existente.id).first()
     
+    # El rol viaja en los claims de los tokens: los refresh tokens emitidos dejan de servir
+    security.revoke_user_refresh_tokens(db, usuario_existente.id)
+
     # Si existe rol en administrativo eliminamos el rol
     if administrativo_existente:
+        rol_anterior = administrativo_existente.rol.value if isinstance(administrativo_existente.rol, Enum) else administrativo_existente.rol
         db.delete(administrativo_existente)
         db.commit()
+        auditoria.registrar(models.TipoEventoAuditoria.cambio_rol, usuario_id=usuario_existente.id, rol_anterior=rol_anterior, rol_nuevo=None)
         return {"msg": "Rol de administrativo eliminado correctamente", "usuario_id": usuario_existente.identificacion}
     else:
         # Si no existe, creamos el rol de administrativo
@@ -589,4 +942,5 @@ def modificar_rol(identificacion: int, nuevo_rol: str, nuevo_area: str, db: Sess
         db.add(nuevo_administrativo)
         db.commit()
         db.refresh(nuevo_administrativo)
+        auditoria.registrar(models.TipoEventoAuditoria.cambio_rol, usuario_id=usuario_existente.id, rol_anterior=None, rol_nuevo=nuevo_rol, area=nuevo_area)
         return {"msg": "Rol de administrativo asignado correctamente", "usuario_id": usuario_existente.identificacion}
@@ -0,0 +1,135 @@
+"""Instrumentación de la API en formato Prometheus.
+
+Métricas expuestas en `/metrics`:
+- Latencia por ruta (histograma) y conteo de peticiones por ruta/estado.
+- Conexiones del pool de SQLAlchemy abiertas y en uso.
+- Tiempo de hashing/verificación de contraseñas (PBKDF2) en login y registro.
+- Resultados de `gestionar_inscripcion` (inscrito, cancelado, sin cupo, ...).
+
+Con gunicorn hay varios procesos: si la variable PROMETHEUS_MULTIPROC_DIR está
+definida, cada worker escribe sus métricas en ese directorio y `/metrics`
+las agrega (ver gunicorn.conf.py).
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    REGISTRY,
+)
+from sqlalchemy import event
+
+
+MULTIPROCESO = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Buckets pensados para una API interactiva (5 ms .. 10 s)
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# PBKDF2 tarda decenas/centenas de ms según el hardware
+BUCKETS_HASH = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+
+LATENCIA_HTTP = Histogram(
+    "uscc_http_duracion_segundos", "Latencia de las peticiones HTTP por ruta",
+    ["metodo", "ruta"], buckets=BUCKETS_HTTP,
+)
+PETICIONES_HTTP = Counter(
+    "uscc_http_peticiones_total", "Peticiones HTTP por ruta y código de estado",
+    ["metodo", "ruta", "estado"],
+)
+EXCEPCIONES_HTTP = Counter(
+    "uscc_http_excepciones_total", "Excepciones no controladas por ruta",
+    ["metodo", "ruta"],
+)
+
+CONEXIONES_ABIERTAS = Gauge(
+    "uscc_db_conexiones_abiertas", "Conexiones abiertas por el pool de SQLAlchemy",
+    ["engine"], multiprocess_mode="livesum",
+)
+CONEXIONES_EN_USO = Gauge(
+    "uscc_db_conexiones_en_uso", "Conexiones del pool prestadas a una sesión",
+    ["engine"], multiprocess_mode="livesum",
+)
+
+HASH_CONTRASENA = Histogram(
+    "uscc_hash_contrasena_segundos", "Tiempo de hashing/verificación de contraseñas",
+    ["operacion"], buckets=BUCKETS_HASH,
+)
+
+LIMITE_RECHAZOS = Counter(
+    "uscc_limite_rechazos_total", "Intentos rechazados por el limitador (HTTP 429)",
+    ["limite"],
+)
+
+AUDITORIA_DESCARTADOS = Counter(
+    "uscc_auditoria_descartados_total", "Eventos de auditoría descartados (cola llena o error al guardar)",
+)
+
+INSCRIPCIONES = Counter(
+    "uscc_inscripciones_total", "Resultados de las operaciones de inscripción",
+    ["resultado"],
+)
+
+
+def instrumentar_engine(engine, nombre: str):
+    """Registra eventos del pool para mantener los gauges de conexiones.
+
+    Hay que llamarla antes de que el engine abra su primera conexión: las abiertas
+    antes no se cuentan y al cerrarlas el gauge quedaría negativo.
+    """
+    abiertas = CONEXIONES_ABIERTAS.labels(engine=nombre)
+    en_uso = CONEXIONES_EN_USO.labels(engine=nombre)
+
+    @event.listens_for(engine, "connect")
+    def _conectar(dbapi_connection, connection_record):
+        abiertas.inc()
+
+    @event.listens_for(engine, "close")
+    def _cerrar(dbapi_connection, connection_record):
+        abiertas.dec()
+
+    @event.listens_for(engine, "checkout")
+    def _prestar(dbapi_connection, connection_record, connection_proxy):
+        en_uso.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _devolver(dbapi_connection, connection_record):
+        en_uso.dec()
+
+
+async def middleware_metricas(request, call_next):
+    """Middleware HTTP que mide latencia y estado de cada petición."""
+    inicio = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        ruta = _ruta(request)
+        EXCEPCIONES_HTTP.labels(request.method, ruta).inc()
+        PETICIONES_HTTP.labels(request.method, ruta, "500").inc()
+        raise
+    ruta = _ruta(request)
+    LATENCIA_HTTP.labels(request.method, ruta).observe(time.perf_counter() - inicio)
+    PETICIONES_HTTP.labels(request.method, ruta, str(response.status_code)).inc()
+    return response
+
+
+def _ruta(request) -> str:
+    # Usamos la plantilla de la ruta (/cursos/{curso_id}/horario) y no la URL real,
+    # así el número de series no crece con cada id distinto
+    route = request.scope.get("route")
+    return getattr(route, "path", "sin_ruta")
+
+
+def exportar() -> tuple:
+    """Devuelve (contenido, content_type) con todas las métricas en formato texto."""
+    if MULTIPROCESO:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
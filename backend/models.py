@@ -1,6 +1,6 @@
 
 import enum
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Time, Enum, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Time, Enum, UniqueConstraint, Boolean, JSON
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -219,7 +219,7 @@ class Inscripcion(Base):
     id = Column(Integer, primary_key=True, index=True)
     horario_id = Column(Integer, ForeignKey("horario.id"))
     usuario_id = Column(Integer, ForeignKey("usuario.id"))
-    fecha_inscripcion = Column(DateTime, nullable=False) # DateTime almacena fecha y hora en formato (año, mes, dia, hora, minuto)
+    fecha_inscripcion = Column(DateTime, index=True, nullable=False) # DateTime almacena fecha y hora en formato (año, mes, dia, hora, minuto)
 
     __table_args__ = (
         # Aseguramos que un usuario no pueda inscribirse en la misma clase más de una vez
@@ -230,3 +230,88 @@ class Inscripcion(Base):
     usuario = relationship("Usuario", back_populates="inscripcion")  # Relación con la tabla Usuarios
 
 
+
+
+
+# Tabla para almacenar los refresh tokens emitidos (permite rotación y revocación)
+class TokenRefresco(Base):
+    __tablename__ = "token_refresco"
+
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, unique=True, index=True, nullable=False)  # "jti" del refresh token vigente de la familia (cambia al rotar)
+    familia = Column(String, index=True, nullable=False)  # Un inicio de sesión: una fila por familia
+    usuario_id = Column(Integer, ForeignKey("usuario.id"), index=True, nullable=False)
+    expira = Column(DateTime, nullable=False)
+    revocado = Column(Boolean, default=False, nullable=False)
+
+
+
+# Tabla con contadores de versión de los datos (ej. "catalogo"); se incrementan en cada escritura
+# administrativa y permiten saber si un artefacto cacheado (reporte, snapshot) sigue vigente
+class VersionDatos(Base):
+    __tablename__ = "version_datos"
+
+    nombre = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
+
+# Clase Enum para los tipos de evento de auditoría
+class TipoEventoAuditoria(enum.Enum):
+    """ Enum para los tipos de evento de auditoría
+    inscripcion = "inscripcion"
+    cancelacion = "cancelacion"
+    cambio_rol = "cambio_rol"
+    curso_creado = "curso_creado"
+    curso_modificado = "curso_modificado"
+    curso_eliminado = "curso_eliminado"
+    horario_creado = "horario_creado"
+    horario_eliminado = "horario_eliminado"
+    """
+    inscripcion = "inscripcion"
+    cancelacion = "cancelacion"
+    cambio_rol = "cambio_rol"
+    curso_creado = "curso_creado"
+    curso_modificado = "curso_modificado"
+    curso_eliminado = "curso_eliminado"
+    horario_creado = "horario_creado"
+    horario_eliminado = "horario_eliminado"
+# Tabla de solo inserción con el historial de inscripciones y cambios administrativos.
+# No usa ForeignKey a propósito: el historial debe sobrevivir al borrado de cursos, horarios o inscripciones
+class EventoAuditoria(Base):
+    __tablename__ = "evento_auditoria"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tipo = Column(Enum(TipoEventoAuditoria, name="tipo_evento_auditoria_enum"), nullable=False)
+    fecha = Column(DateTime, index=True, nullable=False)
+    usuario_id = Column(Integer, index=True, nullable=True)
+    horario_id = Column(Integer, index=True, nullable=True)
+    curso_id = Column(Integer, nullable=True)
+    detalle = Column(JSON, nullable=True)
+
+
+
+# Tabla para almacenar los periodos académicos (ej. "2025-2"); las inscripciones pertenecen
+# al periodo en el que cae su fecha_inscripcion
+class PeriodoAcademico(Base):
+    __tablename__ = "periodo_academico"
+
+    id = Column(Integer, primary_key=True, index=True)
+    nombre = Column(String, unique=True, nullable=False)
+    fecha_inicio = Column(DateTime, nullable=False)  # Incluida
+    fecha_fin = Column(DateTime, nullable=False)  # Excluida
+    cerrado = Column(Boolean, default=False, nullable=False)  # True cuando sus inscripciones ya se archivaron
+    archivado_en = Column(DateTime, nullable=True)
+
+
+
+# Tabla de archivo con las inscripciones de periodos cerrados (ver archivar_periodo.py).
+# Conserva el id original y no usa ForeignKey a horario/usuario para sobrevivir a su borrado
+class InscripcionHistorica(Base):
+    __tablename__ = "inscripcion_historica"
+
+    id = Column(Integer, primary_key=True)
+    horario_id = Column(Integer, index=True, nullable=True)
+    usuario_id = Column(Integer, index=True, nullable=True)
+    fecha_inscripcion = Column(DateTime, nullable=False)
+    periodo_id = Column(Integer, ForeignKey("periodo_academico.id"), index=True, nullable=False)
@@ -0,0 +1,293 @@
+"""Generación de reportes Excel en segundo plano con artefactos cacheados en disco.
+
+Cada reporte se identifica por una clave `cursos_<tipo>_<sello>`, donde el sello
+resume la versión de los datos (versión del catálogo + número e id máximo de
+inscripciones). Mientras los datos no cambien, la misma clave apunta al mismo
+archivo, así que:
+
+- si el archivo ya existe se reutiliza sin volver a generarlo;
+- si otra petición (de este u otro worker) lo está generando, se espera a ese trabajo
+  en lugar de lanzar uno duplicado.
+
+El estado se guarda en el propio directorio (`.xlsx` listo, `.pendiente` en proceso,
+`.error` fallido), de modo que cualquier worker del mismo servidor puede responder
+al sondeo de un trabajo lanzado por otro.
+"""
+import glob
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from openpyxl import Workbook
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+import versiones
+from database import SessionLectura, SessionLocal
+
+
+DIRECTORIO = os.getenv("REPORTES_DIR", os.path.join(tempfile.gettempdir(), "uscc_reportes"))
+MAX_TRABAJOS = int(os.getenv("REPORTES_MAX_TRABAJOS", "2"))
+# Un .pendiente más antiguo que esto se considera abandonado (p. ej. el worker murió).
+# También es lo que se conserva un reporte viejo desde la última vez que alguien lo consultó
+SEGUNDOS_ABANDONO = int(os.getenv("REPORTES_SEGUNDOS_ABANDONO", "900"))
+
+MEDIA_TYPE_EXCEL = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+LISTO = "listo"
+EN_PROCESO = "en_proceso"
+ERROR = "error"
+
+_CLAVE_VALIDA = re.compile(r"^cursos_[a-z]+_[0-9]+-[0-9]+-[0-9]+$")
+
+_pool = ThreadPoolExecutor(max_workers=MAX_TRABAJOS, thread_name_prefix="reporte")
+_trabajos = {}  # clave -> Future de los trabajos lanzados por este proceso
+_candado = threading.Lock()
+
+os.makedirs(DIRECTORIO, exist_ok=True)
+
+
+def generar_excel(db: Session, tipo_curso: Optional[models.TipoCurso]) -> Workbook:
+    """Construye el libro Excel con el mismo contenido que devuelve `/reporte_cursos`.
+    Se crea una hoja por curso; cada fila representa un horario y sus inscripciones (si las hay).
+    """
+    query = db.query(models.Curso)
+    if tipo_curso:
+        query = query.filter(models.Curso.tipo_curso == tipo_curso)
+
+    cursos = query.all()
+
+    wb = Workbook()
+    # Si hay al menos un curso, eliminamos la hoja por defecto y creamos por curso
+    if cursos:
+        # eliminar hoja por defecto
+        default = wb.active
+        wb.remove(default)
+
+        for curso in cursos:
+            # sheet title max 31 chars
+            title = f"{curso.id}_{curso.nombre}"[:31]
+            ws = wb.create_sheet(title=title)
+            # Encabezados
+            ws.append(["Dia", "Hora Inicio", "Hora Fin", "Profesor", "Cantidad Matriculados", "Usuario Nombre", "Identificacion", "Correo", "Fecha Inscripcion"])
+
+            for horario in curso.horario:
+                cantidad = len(horario.inscripcion) if horario.inscripcion else 0
+                # Si hay inscripciones, escribir una fila por cada inscripcion
+                if horario.inscripcion:
+                    for inscripcion in horario.inscripcion:
+                        usuario = db.query(models.Usuario).filter(models.Usuario.id == inscripcion.usuario_id).first()
+                        ws.append([
+                            horario.dia.value if hasattr(horario.dia, 'value') else str(horario.dia),
+                            horario.hora_inicio.isoformat() if horario.hora_inicio else None,
+                            horario.hora_fin.isoformat() if horario.hora_fin else None,
+                            horario.profesor,
+                            cantidad,
+                            usuario.nombre_apellido if usuario else None,
+                            usuario.identificacion if usuario else None,
+                            usuario.correo if usuario else None,
+                            inscripcion.fecha_inscripcion.isoformat() if inscripcion.fecha_inscripcion else None
+                        ])
+                else:
+                    # Sin inscripciones, una sola fila con columnas de usuario vacías
+                    ws.append([
+                        horario.dia.value if hasattr(horario.dia, 'value') else str(horario.dia),
+                        horario.hora_inicio.isoformat() if horario.hora_inicio else None,
+                        horario.hora_fin.isoformat() if horario.hora_fin else None,
+                        horario.profesor,
+                        cantidad,
+                        None,
+                        None,
+                        None,
+                        None
+                    ])
+    else:
+        # Sin cursos: dejar una hoja con un mensaje
+        ws = wb.active
+        ws.title = "Reporte"
+        ws.append(["No hay cursos para el filtro especificado"])
+
+    return wb
+
+
+def sello_datos(db: Session) -> str:
+    """Resume en una cadena la versión de los datos que aparecen en el reporte.
+
+    Los ids de inscripción solo crecen, así que (cantidad, id máximo) cambia con
+    cualquier inscripción o cancelación; los cambios de cursos y horarios los
+    refleja la versión del catálogo.
+    """
+    cantidad, maximo = db.query(func.count(models.Inscripcion.id), func.coalesce(func.max(models.Inscripcion.id), 0)).one()
+    return f"{versiones.obtener(db, versiones.CATALOGO)}-{cantidad}-{maximo}"
+
+
+def clave_reporte(tipo_curso: Optional[models.TipoCurso], sello: str) -> str:
+    return f"cursos_{tipo_curso.name if tipo_curso else 'todos'}_{sello}"
+
+
+def clave_valida(clave: str) -> bool:
+    # Las claves llegan por URL: validarlas evita rutas fuera del directorio
+    return bool(_CLAVE_VALIDA.match(clave))
+
+
+def ruta_artefacto(clave: str) -> str:
+    return os.path.join(DIRECTORIO, f"{clave}.xlsx")
+
+
+def _ruta_pendiente(clave: str) -> str:
+    return os.path.join(DIRECTORIO, f"{clave}.pendiente")
+
+
+def _ruta_error(clave: str) -> str:
+    return os.path.join(DIRECTORIO, f"{clave}.error")
+
+
+def _reclamar(clave: str) -> bool:
+    """Crea el marcador .pendiente de forma atómica. False si otro proceso ya lo tiene."""
+    pendiente = _ruta_pendiente(clave)
+    try:
+        if time.time() - os.path.getmtime(pendiente) > SEGUNDOS_ABANDONO:
+            os.remove(pendiente)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(pendiente, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _generar_en_instantanea(db: Session, tipo_curso: Optional[models.TipoCurso], sello: str) -> Optional[Workbook]:
+    """Genera el libro solo si los datos que ve `db` tienen exactamente el sello `sello`.
+
+    Sello y libro se leen en la misma transacción REPEATABLE READ (misma instantánea), así
+    que el archivo corresponde siempre a la clave bajo la que se guarda.
+    """
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    if sello_datos(db) != sello:
+        return None
+    return generar_excel(db, tipo_curso)
+
+
+def _ejecutar(clave: str, tipo_curso: Optional[models.TipoCurso]):
+    try:
+        sello = clave.rsplit("_", 1)[1]
+        db = SessionLectura()
+        try:
+            wb = _generar_en_instantanea(db, tipo_curso, sello)
+        finally:
+            db.close()
+        if wb is None:
+            # La réplica aún no tiene los datos del sello (va atrasada, o el sello se tomó en la
+            # primaria por "read-your-writes"): se genera en la primaria. Si allí ya cambiaron,
+            # el archivo queda más nuevo que su clave, nunca más viejo
+            db = SessionLocal()
+            try:
+                db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+                wb = generar_excel(db, tipo_curso)
+            finally:
+                db.close()
+        # Escribimos a un temporal y renombramos: nadie ve nunca un archivo a medias
+        temporal = os.path.join(DIRECTORIO, f".{clave}.{os.getpid()}.tmp")
+        wb.save(temporal)
+        os.replace(temporal, ruta_artefacto(clave))
+        _limpiar_anteriores(clave)
+    except Exception as exc:
+        with open(_ruta_error(clave), "w", encoding="utf-8") as f:
+            f.write(str(exc))
+        raise
+    finally:
+        try:
+            os.remove(_ruta_pendiente(clave))
+        except FileNotFoundError:
+            pass
+        with _candado:
+            _trabajos.pop(clave, None)
+
+
+def _limpiar_anteriores(clave: str):
+    # Los reportes del mismo tipo con un sello anterior ya no se volverán a generar, pero
+    # puede haber clientes sondeándolos o descargándolos: solo se borran los que nadie ha
+    # consultado en SEGUNDOS_ABANDONO (estado() renueva la fecha de los que se consultan)
+    prefijo = clave.rsplit("_", 1)[0]
+    limite = time.time() - SEGUNDOS_ABANDONO
+    for ruta in glob.glob(os.path.join(DIRECTORIO, f"{prefijo}_*.xlsx")) + glob.glob(os.path.join(DIRECTORIO, f"{prefijo}_*.error")):
+        if os.path.basename(ruta).startswith(f"{clave}."):
+            continue
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def estado(clave: str) -> Optional[str]:
+    """Estado de un trabajo: LISTO, EN_PROCESO, ERROR o None si no existe."""
+    try:
+        # Consultar un reporte lo mantiene a salvo de _limpiar_anteriores un rato más
+        os.utime(ruta_artefacto(clave))
+        return LISTO
+    except FileNotFoundError:
+        pass
+    with _candado:
+        if clave in _trabajos:
+            return EN_PROCESO
+    if os.path.exists(_ruta_pendiente(clave)):
+        return EN_PROCESO
+    if os.path.exists(_ruta_error(clave)):
+        return ERROR
+    return None
+
+
+def solicitar(db: Session, tipo_curso: Optional[models.TipoCurso]) -> tuple:
+    """Pide el reporte para `tipo_curso`; reutiliza el archivo o el trabajo existente.
+
+    Devuelve (clave, estado).
+    """
+    clave = clave_reporte(tipo_curso, sello_datos(db))
+    if os.path.exists(ruta_artefacto(clave)):
+        return clave, LISTO
+    with _candado:
+        if clave in _trabajos:
+            return clave, EN_PROCESO
+        if not _reclamar(clave):
+            # Otro worker lo está generando
+            return clave, EN_PROCESO
+        try:
+            os.remove(_ruta_error(clave))
+        except FileNotFoundError:
+            pass
+        _trabajos[clave] = _pool.submit(_ejecutar, clave, tipo_curso)
+    return clave, EN_PROCESO
+
+
+def esperar(clave: str, timeout: float) -> Optional[str]:
+    """Espera a que el trabajo termine y devuelve su estado final (None si se agota el tiempo)."""
+    # Un único plazo para las dos esperas: en total nunca más de `timeout`
+    limite = time.monotonic() + timeout
+    with _candado:
+        futuro = _trabajos.get(clave)
+    if futuro is not None:
+        try:
+            futuro.result(timeout=timeout)
+        except Exception:
+            pass
+    # El trabajo puede pertenecer a otro worker: sondeamos el disco
+    while True:
+        actual = estado(clave)
+        if actual != EN_PROCESO or time.monotonic() >= limite:
+            return actual if actual != EN_PROCESO else None
+        time.sleep(0.5)
+
+
+def detalle_error(clave: str) -> str:
+    try:
+        with open(_ruta_error(clave), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
@@ -2,6 +2,8 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 import os
+import secrets
+import uuid
 
 import jwt
 from fastapi import Depends, HTTPException, status
@@ -10,6 +12,7 @@ from sqlalchemy.orm import Session
 
 from database import SessionLocal
 import models
+import metricas
 
 
 # Usar pbkdf2_sha256 evita la limitación de 72 bytes de bcrypt y es una
@@ -19,18 +22,24 @@ pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 def hash_password(password: str) -> str:
     """Devuelve el hash seguro de una contraseña usando PBKDF2-SHA256."""
-    return pwd_context.hash(password)
+    with metricas.HASH_CONTRASENA.labels("hashear").time():
+        return pwd_context.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica que una contraseña en texto plano coincide con su hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    with metricas.HASH_CONTRASENA.labels("verificar").time():
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 # JWT configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "djlqXt67U@%L36bL0$9s6S^Pl8YGrUO")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# Claims del access token que se copian al refresh token, así renovar no necesita consultar el usuario
+CLAIMS_ACCESS = ("sub", "usuario_nombre", "identificacion", "rol", "area")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/iniciar_sesion")
 
@@ -71,12 +80,100 @@ def decode_access_token(token: str) -> dict:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
 
 
+def _encode_refresh_token(claims: dict, usuario_id: int, familia: str) -> tuple:
+    """Firma un refresh token nuevo de `familia`. Devuelve (token, jti, expira)."""
+    now = datetime.utcnow()
+    expire = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    jti = secrets.token_urlsafe(24)
+
+    to_encode = {k: claims.get(k) for k in CLAIMS_ACCESS}
+    to_encode.update({"typ": "refresh", "jti": jti, "fam": familia, "uid": usuario_id, "exp": expire, "iat": now})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM), jti, expire
+
+
+def create_refresh_token(db: Session, claims: dict, usuario_id: int) -> str:
+    """Crea un refresh token de una familia nueva (inicio de sesión) y la registra en la BD (sin hacer commit).
+
+    `claims` son los del access token; se guardan en el refresh para emitir nuevos access tokens.
+    Aprovecha para borrar las familias vencidas del usuario (sesiones abandonadas).
+    """
+    db.query(models.TokenRefresco).filter(
+        models.TokenRefresco.usuario_id == usuario_id,
+        models.TokenRefresco.expira < datetime.utcnow(),
+    ).delete(synchronize_session=False)
+
+    familia = uuid.uuid4().hex
+    token, jti, expire = _encode_refresh_token(claims, usuario_id, familia)
+    db.add(models.TokenRefresco(jti=jti, familia=familia, usuario_id=usuario_id, expira=expire))
+    return token
+
+
+def _decode_refresh_token(token: str) -> dict:
+    payload = decode_access_token(token)
+    if payload.get("typ") != "refresh" or not payload.get("jti") or not payload.get("fam"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token inválido")
+    return payload
+
+
+def rotate_refresh_token(db: Session, token: str) -> tuple:
+    """Valida un refresh token y lo cambia por un nuevo par (access_token, refresh_token).
+
+    Cada familia (inicio de sesión) ocupa una sola fila con el `jti` del único refresh token
+    vigente; al rotar se reemplaza, así que la tabla no crece con cada renovación. Si se
+    presenta un token de la familia que ya no es el vigente (ya fue usado) se asume que fue
+    robado y se revoca la familia.
+    """
+    payload = _decode_refresh_token(token)
+    registro = (
+        db.query(models.TokenRefresco)
+        .filter(models.TokenRefresco.familia == payload["fam"])
+        .order_by(models.TokenRefresco.id.desc())
+        .with_for_update()
+        .first()
+    )
+    if registro is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token inválido")
+    if registro.revocado or registro.jti != payload["jti"]:
+        db.query(models.TokenRefresco).filter(models.TokenRefresco.familia == registro.familia).update(
+            {models.TokenRefresco.revocado: True}, synchronize_session=False
+        )
+        db.commit()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revocado")
+
+    access_token = create_access_token({k: payload.get(k) for k in CLAIMS_ACCESS})
+    refresh_token, registro.jti, registro.expira = _encode_refresh_token(payload, registro.usuario_id, registro.familia)
+    db.commit()
+    return access_token, refresh_token
+
+
+def revoke_refresh_token(db: Session, token: str) -> None:
+    """Revoca la familia del refresh token (cierre de sesión)."""
+    payload = _decode_refresh_token(token)
+    db.query(models.TokenRefresco).filter(models.TokenRefresco.familia == payload["fam"]).update(
+        {models.TokenRefresco.revocado: True}, synchronize_session=False
+    )
+    db.commit()
+
+
+def revoke_user_refresh_tokens(db: Session, usuario_id: int) -> None:
+    """Revoca todos los refresh tokens de un usuario (sin hacer commit).
+
+    Se usa cuando cambian datos que viajan en los claims, como el rol.
+    """
+    db.query(models.TokenRefresco).filter(
+        models.TokenRefresco.usuario_id == usuario_id,
+        models.TokenRefresco.revocado.is_(False),
+    ).update({models.TokenRefresco.revocado: True}, synchronize_session=False)
+
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     """Dependency para FastAPI que devuelve el usuario autenticado a partir del token.
 
     El token debe contener el claim `sub` con la identificación del usuario (identificacion).
     """
     payload = decode_access_token(token)
+    if payload.get("typ") == "refresh":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Se esperaba un access token")
     identificacion = payload.get("sub")
     if identificacion is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token sin sujeto")
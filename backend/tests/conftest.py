@@ -0,0 +1,14 @@
+"""Configuración común de las pruebas.
+
+Los módulos del backend se importan como `import idempotencia`, igual que en main.py,
+así que la carpeta backend tiene que estar en sys.path.
+
+Uso (desde la carpeta backend):
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import os
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
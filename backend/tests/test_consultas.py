@@ -0,0 +1,37 @@
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+from sqlalchemy import text
+
+from utilidades.consultas import presupuesto_consultas
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine("sqlite://")
+    yield engine
+    engine.dispose()
+
+
+def test_presupuesto_cuenta_las_consultas(engine):
+    with presupuesto_consultas(2) as estadisticas:
+        with engine.connect() as conexion:
+            conexion.execute(text("SELECT 1"))
+            conexion.execute(text("SELECT 1"))
+    assert estadisticas.total == 2
+    assert estadisticas.formas["SELECT 1"] == 2
+
+
+def test_presupuesto_superado_falla(engine):
+    with pytest.raises(AssertionError, match="presupuesto: 1"):
+        with presupuesto_consultas(1):
+            with engine.connect() as conexion:
+                for _ in range(3):
+                    conexion.execute(text("SELECT 1"))
+
+
+def test_consulta_fallida_no_deja_su_inicio_en_la_conexion(engine):
+    with engine.connect() as conexion:
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            conexion.execute(text("SELECT * FROM tabla_que_no_existe"))
+        assert conexion.info.get("uscc_inicio_consulta") == []
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi import HTTPException
+
+import idempotencia
+
+
+@pytest.fixture(autouse=True)
+def almacen_limpio(monkeypatch):
+    # Cada prueba usa su propio almacén en memoria
+    monkeypatch.setattr(idempotencia, "_almacen", idempotencia.ResultadosMemoria(100, 60))
+
+
+def test_sin_clave_ejecuta_siempre():
+    llamadas = []
+    for _ in range(2):
+        estado, cuerpo, repetido = idempotencia.ejecutar(None, ("inscribir", 1, 10), lambda: llamadas.append(1) or {"msg": "ok"})
+        assert (estado, cuerpo, repetido) == (200, {"msg": "ok"}, False)
+    assert len(llamadas) == 2
+
+
+def test_reintento_repite_el_resultado_original():
+    contador = iter(range(10))
+    operacion = lambda: {"n": next(contador)}
+
+    primero = idempotencia.ejecutar("clave-1", ("inscribir", 1, 10), operacion)
+    segundo = idempotencia.ejecutar("clave-1", ("inscribir", 1, 10), operacion)
+
+    assert primero == (200, {"n": 0}, False)
+    assert segundo == (200, {"n": 0}, True)
+
+
+def test_errores_4xx_se_repiten_y_5xx_no():
+    def sin_cupo():
+        raise HTTPException(status_code=400, detail="No hay cupo disponible en este horario")
+
+    assert idempotencia.ejecutar("clave-4xx", ("inscribir", 1, 10), sin_cupo)[2] is False
+    assert idempotencia.ejecutar("clave-4xx", ("inscribir", 1, 10), lambda: {"msg": "ok"}) == (
+        400, {"detail": "No hay cupo disponible en este horario"}, True,
+    )
+
+    def caida():
+        raise HTTPException(status_code=503, detail="BD no disponible")
+
+    idempotencia.ejecutar("clave-5xx", ("inscribir", 1, 10), caida)
+    assert idempotencia.ejecutar("clave-5xx", ("inscribir", 1, 10), lambda: {"msg": "ok"}) == (200, {"msg": "ok"}, False)
+
+
+def test_clave_reutilizada_con_otra_operacion_da_422():
+    idempotencia.ejecutar("clave-2", ("inscribir", 1, 10), lambda: {"msg": "ok"})
+    with pytest.raises(HTTPException) as exc:
+        idempotencia.ejecutar("clave-2", ("cancelar", 1, 10), lambda: {"msg": "ok"})
+    assert exc.value.status_code == 422
+
+
+def test_reintentos_simultaneos_ejecutan_una_sola_vez():
+    llamadas = []
+    barrera = threading.Barrier(8)
+
+    def operacion():
+        llamadas.append(1)
+        time.sleep(0.05)
+        return {"msg": "Inscripción realizada correctamente"}
+
+    resultados = []
+
+    def reintento():
+        barrera.wait()
+        resultados.append(idempotencia.ejecutar("clave-3", ("inscribir", 1, 10), operacion))
+
+    hilos = [threading.Thread(target=reintento) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(llamadas) == 1
+    assert sorted(r[2] for r in resultados) == [False] + [True] * 7
+    assert {r[1]["msg"] for r in resultados} == {"Inscripción realizada correctamente"}
+
+
+def test_reintento_que_llega_justo_al_terminar_no_vuelve_a_ejecutar(monkeypatch):
+    # Forzamos que el reintento llegue después de guardar el resultado pero antes de que la
+    # original deje de estar en curso: debe repetir el resultado, no ejecutar otra vez
+    almacen = idempotencia._almacen
+    liberar_original = almacen.liberar
+    llamadas = []
+    respuesta_reintento = []
+
+    def operacion():
+        llamadas.append(1)
+        return {"n": len(llamadas)}
+
+    hilo = None
+
+    def liberar_en_otro_hilo(clave):
+        nonlocal hilo
+        monkeypatch.setattr(almacen, "liberar", liberar_original)
+        hilo = threading.Thread(target=lambda: respuesta_reintento.append(
+            idempotencia.ejecutar(clave, ("inscribir", 1, 10), operacion)))
+        hilo.start()
+        time.sleep(0.05)
+        liberar_original(clave)
+
+    monkeypatch.setattr(almacen, "liberar", liberar_en_otro_hilo)
+    original = idempotencia.ejecutar("clave-4", ("inscribir", 1, 10), operacion)
+    hilo.join()
+
+    assert len(llamadas) == 1
+    assert original == (200, {"n": 1}, False)
+    assert respuesta_reintento == [(200, {"n": 1}, True)]
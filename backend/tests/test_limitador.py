@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+
+import limitador
+
+
+@pytest.fixture(autouse=True)
+def almacen_limpio(monkeypatch):
+    monkeypatch.setattr(limitador, "_almacen", limitador.BucketsMemoria(100))
+
+
+def _agotado(*limites) -> bool:
+    try:
+        limitador.verificar(*limites)
+        return False
+    except limitador.HTTPException as exc:
+        assert exc.status_code == 429
+        return True
+
+
+def test_bucket_por_ip_solo_cuenta_fallos():
+    por_ip = limitador.Limite("prueba_ip", 2, 0.001, solo_fallos=True)
+    # Inicios de sesión correctos desde la misma IP (p. ej. NAT del campus)
+    assert not any(_agotado((por_ip, "10.0.0.1")) for _ in range(20))
+
+    limitador.registrar_fallo(por_ip, "10.0.0.1")
+    limitador.registrar_fallo(por_ip, "10.0.0.1")
+    assert _agotado((por_ip, "10.0.0.1"))
+    assert not _agotado((por_ip, "10.0.0.2"))
+
+
+def test_rechazo_no_gasta_tokens_de_los_demas_buckets():
+    por_ip = limitador.Limite("prueba_ip", 1, 0.001)
+    por_id = limitador.Limite("prueba_id", 3, 0.001)
+
+    assert not _agotado((por_ip, "10.0.0.1"), (por_id, 123))
+    # Bloqueado por IP: los intentos no deben bloquear la cuenta 123
+    for _ in range(10):
+        assert _agotado((por_ip, "10.0.0.1"), (por_id, 123))
+    assert not _agotado((por_ip, "10.0.0.2"), (por_id, 123))
+    assert not _agotado((por_ip, "10.0.0.3"), (por_id, 123))
@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class CacheLRU:
+    """Diccionario acotado en memoria: expulsa la entrada menos usada al superar `maximo`.
+
+    Si `ttl` (segundos) es distinto de None las entradas caducan pasado ese tiempo.
+    Es seguro usarlo desde varios hilos (FastAPI ejecuta endpoints síncronos en un threadpool).
+    """
+
+    def __init__(self, maximo: int, ttl: Optional[float] = None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (expira, valor)
+        self._candado = threading.Lock()
+
+    def obtener(self, clave, defecto: Any = None) -> Any:
+        with self._candado:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return defecto
+            expira, valor = entrada
+            if expira is not None and expira < time.monotonic():
+                del self._datos[clave]
+                return defecto
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor: Any):
+        expira = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._candado:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def eliminar(self, clave):
+        with self._candado:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._candado:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
@@ -0,0 +1,145 @@
+"""Conteo de consultas SQL por petición y detección de N+1.
+
+Se engancha a los eventos de SQLAlchemy de *todos* los engines, así que no hace
+falta tocar cada endpoint: basta con registrar `middleware_consultas` en la app.
+
+- Cada petición acumula el número de sentencias y el tiempo total en BD.
+- Si una misma forma de sentencia se repite más de `UMBRAL_N_MAS_1` veces en la
+  misma petición se registra un warning (consulta dentro de un bucle).
+- En modo DEBUG se devuelven las cabeceras `X-DB-Consultas` y `X-DB-Tiempo-Ms`.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("uscc.consultas")
+
+DEBUG = os.getenv("DEBUG", "false").lower() in ("1", "true", "si")
+UMBRAL_N_MAS_1 = int(os.getenv("UMBRAL_N_MAS_1", "10"))
+
+_ESPACIOS = re.compile(r"\s+")
+
+
+class EstadisticasConsultas:
+    """Acumulador de las consultas ejecutadas durante una petición (o un bloque de test)."""
+
+    __slots__ = ("total", "tiempo", "formas")
+
+    def __init__(self):
+        self.total = 0
+        self.tiempo = 0.0  # segundos
+        self.formas = Counter()  # forma de la sentencia -> veces ejecutada
+
+    def registrar(self, sentencia: str, duracion: float):
+        self.total += 1
+        self.tiempo += duracion
+        self.formas[sentencia] += 1
+
+    def repetidas(self, umbral: int) -> list:
+        """Formas de sentencia que se ejecutaron más de `umbral` veces."""
+        return [(forma, n) for forma, n in self.formas.items() if n > umbral]
+
+
+# Estadísticas de la petición en curso. El contexto se copia al threadpool donde
+# FastAPI ejecuta los endpoints síncronos, así que el objeto es compartido.
+_estadisticas: ContextVar[Optional[EstadisticasConsultas]] = ContextVar("estadisticas_consultas", default=None)
+
+# Colectores globales usados por los tests: reciben las consultas de cualquier hilo
+_colectores_globales = []
+_candado_colectores = threading.Lock()
+
+
+def _forma(sentencia: str) -> str:
+    # Las sentencias ya vienen parametrizadas; solo normalizamos espacios
+    return _ESPACIOS.sub(" ", sentencia).strip()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("uscc_inicio_consulta", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    duracion = time.perf_counter() - conn.info["uscc_inicio_consulta"].pop()
+    estadisticas = _estadisticas.get()
+    if estadisticas is None and not _colectores_globales:
+        return
+    forma = _forma(statement)
+    if estadisticas is not None:
+        estadisticas.registrar(forma, duracion)
+    if _colectores_globales:
+        with _candado_colectores:
+            for colector in _colectores_globales:
+                colector.registrar(forma, duracion)
+
+
+@event.listens_for(Engine, "handle_error")
+def _error_al_ejecutar(contexto):
+    # Una sentencia que falla (p. ej. el IntegrityError esperado al inscribir dos veces) no
+    # llega a after_cursor_execute: sin esto su inicio quedaría en la conexión del pool para siempre
+    if contexto.connection is not None and contexto.cursor is not None:
+        inicios = contexto.connection.info.get("uscc_inicio_consulta")
+        if inicios:
+            inicios.pop()
+
+
+async def middleware_consultas(request, call_next):
+    """Middleware HTTP que mide las consultas de cada petición."""
+    estadisticas = EstadisticasConsultas()
+    token = _estadisticas.set(estadisticas)
+    try:
+        response = await call_next(request)
+    finally:
+        _estadisticas.reset(token)
+
+    for forma, veces in estadisticas.repetidas(UMBRAL_N_MAS_1):
+        logger.warning(
+            "Posible N+1 en %s %s: la misma consulta se ejecutó %d veces: %s",
+            request.method, request.url.path, veces, forma[:300],
+        )
+
+    if DEBUG:
+        response.headers["X-DB-Consultas"] = str(estadisticas.total)
+        response.headers["X-DB-Tiempo-Ms"] = f"{estadisticas.tiempo * 1000:.2f}"
+    return response
+
+
+@contextmanager
+def presupuesto_consultas(maximo: int):
+    """Helper para tests: falla si el bloque ejecuta más de `maximo` consultas.
+
+    Captura las consultas de cualquier hilo (TestClient ejecuta la app en otro), por lo
+    que no debe usarse con peticiones concurrentes ajenas al test.
+
+        with presupuesto_consultas(3):
+            client.get("/cursos/1/horario", params={"identificacion": 123})
+    """
+    estadisticas = EstadisticasConsultas()
+    with _candado_colectores:
+        _colectores_globales.append(estadisticas)
+    try:
+        yield estadisticas
+    finally:
+        with _candado_colectores:
+            _colectores_globales.remove(estadisticas)
+    if estadisticas.total > maximo:
+        detalle = "\n".join(f"  {n}x {forma[:200]}" for forma, n in estadisticas.formas.most_common())
+        raise AssertionError(f"Se ejecutaron {estadisticas.total} consultas (presupuesto: {maximo}):\n{detalle}")
+
+
+def afirmar_presupuesto(cliente, metodo: str, ruta: str, maximo: int, **kwargs):
+    """Lanza una petición con `cliente` (TestClient) y comprueba su presupuesto de consultas."""
+    with presupuesto_consultas(maximo):
+        respuesta = cliente.request(metodo, ruta, **kwargs)
+    return respuesta
@@ -0,0 +1,30 @@
+"""Contadores de versión de los datos guardados en la tabla `version_datos`.
+
+Las escrituras administrativas (cursos y horarios) incrementan la versión del
+catálogo dentro de su propia transacción; quien cachea datos derivados compara
+la versión para saber si debe regenerarlos.
+"""
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+import models
+
+
+CATALOGO = "catalogo"
+
+
+def incrementar(db: Session, nombre: str) -> int:
+    """Incrementa la versión `nombre` (sin hacer commit) y devuelve la nueva. Crea el contador si no existe."""
+    tabla = models.VersionDatos.__table__
+    return db.execute(
+        insert(tabla)
+        .values(nombre=nombre, version=1)
+        .on_conflict_do_update(index_elements=[tabla.c.nombre], set_={"version": tabla.c.version + 1})
+        .returning(tabla.c.version)
+    ).scalar()
+
+
+def obtener(db: Session, nombre: str) -> int:
+    """Devuelve la versión actual de `nombre` (0 si nunca se ha incrementado)."""
+    version = db.query(models.VersionDatos.version).filter(models.VersionDatos.nombre == nombre).scalar()
+    return version or 0